@@ -0,0 +1,170 @@
+import weakref
+import numpy as np
+import pandas as pd
+from preprocessor import DAY_NAMES, MONTHS, TIME_PERIODS
+from user_index import OVERALL
+
+HOURS = 24
+
+# Roll-up granularities: label -> pandas period frequency
+GRANULARITIES = {'Day': 'D', 'Week': 'W', 'Month': 'M', 'Quarter': 'Q', 'Year': 'Y'}
+
+
+def _count_dtype(maximum):
+    return np.uint16 if maximum <= np.iinfo(np.uint16).max else np.uint32
+
+
+class ActivityCube:
+    """
+    Message counts of a chat by user, calendar day and hour, in one dense integer array of shape
+    (users, days, 24) where day 0 is start. Every timeline, activity map and heatmap is a sum over
+    some of its axes, so none of them touches the message rows.
+    """
+
+    def __init__(self, users, start, counts):
+        self.users = list(users)
+        self.code_of = {user: code for code, user in enumerate(self.users)}
+        self.start = np.datetime64(start, 'D')
+        self.counts = counts
+
+    @property
+    def days(self):
+        return self.start + np.arange(self.counts.shape[1])
+
+    def grid(self, user=OVERALL):
+        """
+        The (days, 24) counts of one user, or of every user for 'Overall'.
+        """
+        if user == OVERALL:
+            return self.counts.sum(axis=0, dtype=np.int64)
+        code = self.code_of.get(user)
+        if code is None:
+            return np.zeros(self.counts.shape[1:], dtype=np.int64)
+        return self.counts[code].astype(np.int64)
+
+    def slice(self, start=None, end=None):
+        """
+        The cube of the days from start (inclusive) to end (exclusive), sharing this cube's array.
+        """
+        first = 0 if start is None else int(np.clip((np.datetime64(start, 'D') - self.start).astype(int), 0, None))
+        last = self.counts.shape[1] if end is None else \
+            int(np.clip((np.datetime64(end, 'D') - self.start).astype(int), first, self.counts.shape[1]))
+        return ActivityCube(self.users, self.start + first, self.counts[:, first:last])
+
+    def merge(self, other):
+        """
+        The cube counting the messages of both cubes, e.g. of two disjoint parts of a chat.
+        """
+        users = self.users + [user for user in other.users if user not in self.code_of]
+        start = min(self.start, other.start)
+        end = max(self.start + self.counts.shape[1], other.start + other.counts.shape[1])
+        counts = np.zeros((len(users), int((end - start).astype(int)), HOURS), dtype=np.int64)
+        for cube in (self, other):
+            offset = int((cube.start - start).astype(int))
+            codes = [users.index(user) for user in cube.users]
+            counts[codes, offset:offset + cube.counts.shape[1]] += cube.counts
+        return ActivityCube(users, start, counts.astype(_count_dtype(counts.max(initial=0))))
+
+    def daily(self, user=OVERALL):
+        """
+        Messages per calendar day, for every day the cube spans.
+        """
+        return pd.Series(self.grid(user).sum(axis=1), index=pd.DatetimeIndex(self.days, name='only_date'))
+
+    def periods(self, user=OVERALL, freq='M'):
+        """
+        Messages per period of a pandas frequency ('D', 'W', 'M', 'Q', 'Y'), indexed by period,
+        including empty periods.
+        """
+        daily = self.daily(user)
+        return daily.groupby(daily.index.to_period(freq)).sum()
+
+    def rollup(self, user=OVERALL, freq='D'):
+        """
+        Like periods, indexed by the start of each period.
+        """
+        totals = self.periods(user, freq)
+        totals.index = totals.index.start_time
+        return totals
+
+    def monthly_timeline(self, user=OVERALL):
+        """
+        The months with messages, as a frame of year, month_num, month, message and a
+        'Month-Year' time label.
+        """
+        months = self.periods(user, 'M')
+        months = months[months > 0]
+        month_num = months.index.month.to_numpy().astype(np.int64)
+        timeline = pd.DataFrame({
+            'year': months.index.year.to_numpy().astype(np.int64),
+            'month_num': month_num,
+            'month': pd.Categorical.from_codes(month_num - 1, MONTHS, ordered=True),
+            'message': months.to_numpy(),
+        })
+        timeline['time'] = timeline['month'].astype(str) + "-" + timeline['year'].astype(str)
+        return timeline
+
+    def daily_timeline(self, user=OVERALL):
+        """
+        The days with messages, as a frame of only_date and message.
+        """
+        daily = self.daily(user)
+        return daily[daily > 0].rename('message').reset_index()
+
+    def weekday_hour(self, user=OVERALL):
+        """
+        The (7, 24) counts by day of the week (Monday first) and hour.
+        """
+        grid = self.grid(user)
+        weekdays = pd.DatetimeIndex(self.days).dayofweek.to_numpy()
+        totals = np.zeros((len(DAY_NAMES), HOURS), dtype=np.int64)
+        np.add.at(totals, weekdays, grid)
+        return totals
+
+    def busy_day(self, user=OVERALL):
+        counts = self.weekday_hour(user).sum(axis=1)
+        return pd.Series(counts, index=pd.CategoricalIndex(DAY_NAMES, DAY_NAMES, ordered=True, name='day_name'))
+
+    def busy_month(self, user=OVERALL):
+        months = self.periods(user, 'M')
+        counts = np.bincount(months.index.month - 1, weights=months.to_numpy(), minlength=len(MONTHS))
+        return pd.Series(counts.astype(np.int64), index=pd.CategoricalIndex(MONTHS, MONTHS, ordered=True, name='month'))
+
+    def heatmap(self, user=OVERALL):
+        return pd.DataFrame(self.weekday_hour(user),
+                            index=pd.CategoricalIndex(DAY_NAMES, DAY_NAMES, ordered=True, name='day_name'),
+                            columns=pd.CategoricalIndex(TIME_PERIODS, TIME_PERIODS, ordered=True, name='time_period'))
+
+
+def build_cube(df):
+    """
+    Count the messages of a parsed chat by user, day and hour. Users are kept in order of
+    first appearance.
+    """
+    codes, users = pd.factorize(df['user'])
+    days = df['date'].to_numpy().astype('datetime64[D]')
+    if not len(days):
+        return ActivityCube(users, np.datetime64(0, 'D'), np.zeros((0, 0, HOURS), dtype=np.uint16))
+    start = days.min()
+    day = (days - start).astype(np.int64)
+    num_days = int(day.max()) + 1
+    cells = (codes * num_days + day) * HOURS + df['date'].dt.hour.to_numpy()
+    counts = np.bincount(cells, minlength=len(users) * num_days * HOURS)
+    return ActivityCube(users, start, counts.reshape(len(users), num_days, HOURS).astype(_count_dtype(counts.max())))
+
+
+_cubes = {}
+
+
+def activity_cube(df):
+    """
+    Return the ActivityCube of a parsed chat, building it on first use. Like user_index, the cube
+    lives as long as the frame, which must not be modified afterwards.
+    """
+    key = id(df)
+    cube = _cubes.get(key)
+    if cube is None:
+        cube = build_cube(df)
+        _cubes[key] = cube
+        weakref.finalize(df, _cubes.pop, key, None)
+    return cube
@@ -0,0 +1,143 @@
+from collections import Counter, defaultdict
+import activity_cube
+import emojis
+import pandas as pd
+import lexicons
+import links
+from user_index import GROUP_NOTIFICATION, OVERALL
+
+MEDIA_MESSAGE = '<Media omitted>\n'
+
+# Bump whenever the aggregates change, so those cached by chat_cache are computed again
+AGGREGATES_VERSION = 2
+
+
+def _most_busy(counts):
+    return counts.sort_values(ascending=False, kind='stable')
+
+
+# name -> reduction of the activity cube for one user. The activity maps keep days/months/periods
+# without messages as zeros, like value_counts and pivot_table; the timelines leave them out.
+TABLES = {
+    'monthly_timeline': lambda cube, user: cube.monthly_timeline(user),
+    'daily_timeline': lambda cube, user: cube.daily_timeline(user),
+    'busy_day': lambda cube, user: _most_busy(cube.busy_day(user)),
+    'busy_month': lambda cube, user: _most_busy(cube.busy_month(user)),
+    'heatmap': lambda cube, user: cube.heatmap(user),
+}
+
+
+def _scan_messages(df):
+    """
+    Tokenize every message once, counting words, media and links per user, plus the
+    stop-word filtered words used by the common words table.
+    """
+    stop_words = lexicons.stop_words()
+    stats = defaultdict(lambda: [0, 0, 0])
+    words = defaultdict(Counter)
+
+    for user, message in zip(df['user'], df['message']):
+        user_stats = stats[user]
+        user_stats[0] += len(message.split())
+        user_stats[2] += len(links.find_links(message))
+        if message == MEDIA_MESSAGE:
+            user_stats[1] += 1
+        elif user != GROUP_NOTIFICATION:
+            words[user].update(word for word in message.lower().split() if word not in stop_words)
+
+    return dict(stats), dict(words)
+
+
+def aggregate(df):
+    """
+    Scan a parsed chat once into per-user aggregates: message/word/media/link counts, word and
+    emoji counters, and the activity cube behind every table. Aggregates of consecutive parts of
+    a chat can be combined with merge.
+    """
+    stats, words = _scan_messages(df)
+    emoji_counts, _ = emojis.count_emojis_by_user(df)
+    return {
+        'messages': df['user'].value_counts(sort=False),
+        'stats': stats,
+        'words': words,
+        'emojis': emoji_counts,
+        'cube': activity_cube.build_cube(df),
+    }
+
+
+def _merge_counters(first, second):
+    merged = dict(first)
+    for user, counts in second.items():
+        merged[user] = merged[user] + counts if user in merged else counts
+    return merged
+
+
+def _add_counts(first, second):
+    return first.add(second, fill_value=0).astype('int64')
+
+
+def merge(first, second):
+    """
+    Combine the aggregates of two disjoint parts of a chat.
+    """
+    stats = dict(first['stats'])
+    for user, user_stats in second['stats'].items():
+        stats[user] = [a + b for a, b in zip(stats.get(user, [0, 0, 0]), user_stats)]
+    return {
+        'messages': _add_counts(first['messages'], second['messages']),
+        'stats': stats,
+        'words': _merge_counters(first['words'], second['words']),
+        'emojis': _merge_counters(first['emojis'], second['emojis']),
+        'cube': first['cube'].merge(second['cube']),
+    }
+
+
+def _most_busy_users(message_counts):
+    counts = message_counts.drop(GROUP_NOTIFICATION, errors='ignore').sort_values(ascending=False, kind='stable')
+    percent = round((counts / counts.sum()) * 100, 2)
+    percent_df = pd.DataFrame({'name': percent.index, 'percent(%)': percent.values})
+    return counts.head().rename('user'), percent_df
+
+
+def _common_words_frame(counter):
+    most_common_df = pd.DataFrame(counter.most_common(20))
+    return most_common_df.rename(columns={0: 'Common Word', 1: 'Word Count'})
+
+
+def build_bundle(aggregates):
+    """
+    Turn aggregates into the results of the analysis page for 'Overall' and each user.
+    Returns {user: {name: result}}, so switching users is a dictionary lookup.
+    """
+    message_counts = aggregates['messages']
+    totals = [sum(column) for column in zip(*aggregates['stats'].values())] or [0, 0, 0]
+
+    cube = aggregates['cube']
+    bundle = {}
+    for user in [OVERALL] + message_counts.index.tolist():
+        if user == OVERALL:
+            num_messages = int(message_counts.sum())
+            results = {name: table(cube, OVERALL) for name, table in TABLES.items()}
+            results['most_busy_users'] = _most_busy_users(message_counts)
+            words = sum(aggregates['words'].values(), Counter())
+            emoji_counts = sum(aggregates['emojis'].values(), Counter())
+            stats = totals
+        else:
+            num_messages = int(message_counts[user])
+            results = {name: table(cube, user) for name, table in TABLES.items()}
+            words = aggregates['words'].get(user, Counter())
+            emoji_counts = aggregates['emojis'].get(user, Counter())
+            stats = aggregates['stats'][user]
+        results['stats'] = (num_messages,) + tuple(stats)
+        results['words'] = words
+        results['most_common_words'] = _common_words_frame(words)
+        results['emojis'] = emojis.emoji_frame(emoji_counts)
+        bundle[user] = results
+    return bundle
+
+
+def analyze(df):
+    """
+    Compute every statistic of the analysis page for 'Overall' and each user in one scan.
+    """
+    return build_bundle(aggregate(df))
@@ -1,18 +1,20 @@
 import os
-import matplotlib.pyplot as plt
-import seaborn as sns
 import streamlit as st
 import pandas as pd
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.linear_model import LogisticRegression
-from sklearn.metrics import accuracy_score, classification_report
-from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.naive_bayes import MultinomialNB
-from sklearn.svm import SVC
-import helper
-import preprocessor
-from textblob import TextBlob
+import activity_cube
+import analysis
+import chat_cache
+import conversations
+import instrumentation
+from user_index import user_index
+
+# Plotting (matplotlib, seaborn, wordcloud), scikit-learn, TextBlob and pyarrow datasets are imported
+# where they are used, so the upload page and every rerun before "Show Analysis" do not load them.
+
+COUNT_FEATURIZATION = "Word counts (in memory)"
+STREAMING_FEATURIZATION = "Feature hashing (streaming)"
+WORDCLOUD_SIZE = (500, 500)
+SEARCH_MODES = {"Exact text": 'literal', "All words": 'all', "Word prefixes": 'prefix'}
 
 
 def calculate_accuracy(textblob_sentiments, ml_sentiments):
@@ -36,28 +38,20 @@ def display_accuracy_comparison(textblob_sentiments, ml_sentiments):
     return comparison_results
 
 
-def textblob_sentiment_analysis(messages):
+def textblob_sentiment_analysis(messages, processes=1):
     """
-    Perform sentiment analysis using TextBlob.
+    Perform sentiment analysis using TextBlob, scoring each distinct message once.
     """
-    sentiments = []
-    for message in messages:
-        blob = TextBlob(message)
-        polarity = blob.sentiment.polarity
-        if polarity > 0:
-            sentiment = 'positive'
-        elif polarity < 0:
-            sentiment = 'negative'
-        else:
-            sentiment = 'neutral'
-        sentiments.append(sentiment)
-    return sentiments
+    import polarity
+    return polarity.label_messages(messages, processes)
 
 
 def compare_sentiment_analysis(textblob_sentiments, ml_sentiments, messages):
     """
     Compare sentiment analysis results from TextBlob with ML models.
     """
+    if not ml_sentiments:
+        return {}
     min_length = min(len(textblob_sentiments), min(len(sentiments) for sentiments in ml_sentiments.values()))
     comparison_results = {}
     for model_name, ml_sentiment in ml_sentiments.items():
@@ -70,70 +64,194 @@ def compare_sentiment_analysis(textblob_sentiments, ml_sentiments, messages):
     return comparison_results
 
 
-def train_models(X_train, y_train, models):
+def train_models(run, models, workers=None, time_budget=None):
     """
-    Train machine learning models.
+    Train machine learning models in a process pool, reusing or updating the ones cached for this
+    training run, and show each model's evaluation as soon as it finishes.
     """
+    import model_registry
+    st.write(f"Training {', '.join(models)}...")
     trained_models = {}
-    for model_name, model in models.items():
-        st.write(f"Training {model_name}...")
-        model.fit(X_train, y_train)
+    for model_name, model, how, y_pred in model_registry.fit_models(run, models, workers, time_budget):
+        if model is None:
+            st.warning(f"{model_name} {how}.")
+            continue
+        if how != 'trained':
+            st.write(f"{model_name} {how} from cache.")
+        if y_pred is None:
+            y_pred = model.predict(run.X_test)
         trained_models[model_name] = model
+        evaluate_model(model_name, run.y_test, y_pred)
     return trained_models
 
 
-def evaluate_models(trained_models, X_test, y_test):
+def evaluate_model(model_name, y_test, y_pred):
+    """
+    Show the evaluation of a trained machine learning model.
+    """
+    from sklearn.metrics import accuracy_score, classification_report
+    st.header(f"Evaluation Results for {model_name}")
+    accuracy = accuracy_score(y_test, y_pred)
+    report = classification_report(y_test, y_pred, output_dict=True)
+    st.success(f"{model_name} Accuracy: {accuracy:.2%}")
+    report_df = pd.DataFrame(report).transpose()
+    st.info(f"{model_name} Classification Report:")
+    st.table(report_df)
+
+
+@st.cache_resource(max_entries=4)
+def load_user_list(chat_key, _df):
     """
-    Evaluate trained machine learning models.
+    The sidebar user list of a chat, computed once per chat rather than on every rerun.
     """
-    for model_name, model in trained_models.items():
-        st.header(f"Evaluation Results for {model_name}")
-        y_pred = model.predict(X_test)
-        accuracy = accuracy_score(y_test, y_pred)
-        report = classification_report(y_test, y_pred, output_dict=True)
-        st.success(f"{model_name} Accuracy: {accuracy:.2%}")
-        report_df = pd.DataFrame(report).transpose()
-        st.info(f"{model_name} Classification Report:")
-        st.table(report_df)
+    return user_index(_df).user_list()
 
 
-def main():
-    models = {
+@st.cache_resource(max_entries=4)
+def load_analysis(chat_key, _df):
+    """
+    Build the analysis bundle once per chat from its cached aggregates; the DataFrame is
+    identified by chat_key, not hashed.
+    """
+    return analysis.build_bundle(chat_cache.load_aggregates(chat_key, _df))
+
+
+@st.cache_resource(max_entries=4)
+def load_activity(chat_key, _df):
+    """
+    The activity cube of a chat, from its cached aggregates.
+    """
+    return chat_cache.load_aggregates(chat_key, _df)['cube']
+
+
+@st.cache_data(max_entries=32)
+def load_wordcloud(chat_key, user, width, height, _words):
+    """
+    Render the wordcloud of a user once per chat, user and size, from the user's word counts.
+    Returns the image as an array, or None when the user has no words.
+    """
+    import helper
+    wc = helper.render_wordcloud(_words, width, height)
+    return None if wc is None else wc.to_array()
+
+
+@st.cache_resource(max_entries=8)
+def load_conversations(chat_key, _df, gap_minutes):
+    """
+    The sessions and replies of a chat once per chat and session gap.
+    """
+    return conversations.build_conversations(_df, gap_minutes)
+
+
+@st.cache_resource(max_entries=4)
+def load_search_index(chat_key, _df):
+    """
+    Load the keyword search index of a chat once per process.
+    """
+    return chat_cache.load_search_index(chat_key, _df)
+
+
+def classification_models():
+    """
+    The models trained on word count features.
+    """
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.naive_bayes import MultinomialNB
+    from sklearn.svm import SVC
+    return {
         'Logistic Regression': LogisticRegression(),
         'Random Forest': RandomForestClassifier(),
         'Multinomial Naive Bayes': MultinomialNB(),
         'Support Vector Machine': SVC()
     }
 
+
+def show_performance(recorder):
+    """
+    Sidebar panel with the stages measured during this run, and their JSON lines for download.
+    """
+    st.sidebar.header("Performance")
+    if not recorder.records:
+        st.sidebar.write("Nothing was measured in this run.")
+        return
+    records = pd.DataFrame(recorder.records).astype({'rows': 'Int64'})
+    # nested stages are indented under the stage that ran them
+    records['stage'] = ['\u2003' * depth + name for depth, name in zip(records['depth'], records['stage'])]
+    st.sidebar.dataframe(records[['stage', 'rows', 'wall_s', 'cpu_s', 'peak_rss_delta_mb']],
+                         use_container_width=True, hide_index=True)
+    st.sidebar.download_button("Download as JSON lines", recorder.json_lines(), file_name="performance.jsonl",
+                               mime="application/x-ndjson")
+
+
+def main():
     st.set_page_config(page_title="Whatsapp Chat Analyzer", page_icon=":bar_chart:", layout="wide")
     st.sidebar.image('whatsapp.png', width=75)
     st.sidebar.title("Whatsapp Chat Analyzer")
 
+    # measuring costs a thread and a few syscalls per stage, so it only runs when asked for
+    if st.sidebar.checkbox("Show performance panel"):
+        with instrumentation.recording() as recorder:
+            show_chat_page()
+        show_performance(recorder)
+    else:
+        show_chat_page()
+
+
+def show_chat_page():
     uploaded_file = st.sidebar.file_uploader("Choose a file")
     consent_given = st.sidebar.checkbox(
         "Give consent for training data usage. Your chats won't be uploaded to the internet. It will just be used to enhance our training model. This will help us improve the accuracy of our models")
+    featurization = st.sidebar.radio("Sentiment model features", [COUNT_FEATURIZATION, STREAMING_FEATURIZATION])
+    training_workers = st.sidebar.number_input("Model training processes", min_value=1, value=os.cpu_count() or 1)
+    time_budget = st.sidebar.number_input("Time budget per model in seconds (0 for none)", min_value=0, value=0)
 
     if uploaded_file is not None:
-        bytes_data = uploaded_file.getvalue()
-        data = bytes_data.decode('utf-8')
-        df = preprocessor.preprocess(data)
+        # reuse the parsed frame cached on disk for this exact export, parsing it only once
+        chat_key = chat_cache.content_hash(uploaded_file)
+        with instrumentation.stage('load_chat') as record:
+            df = chat_cache.load_chat(uploaded_file, key=chat_key)
+            record['rows'] = len(df)
         st.header("DataFrame")
         st.dataframe(df, use_container_width=True)
 
-        user_list = df['user'].unique().tolist()
-        if 'group notification' in user_list:
-            user_list.remove('group notification')
-        user_list.sort()
-        user_list.insert(0, 'Overall')
+        user_list = load_user_list(chat_key, df)
         selected_user = st.sidebar.selectbox("Show analysis wrt", user_list)
+        granularity = st.sidebar.selectbox("Activity timeline by", list(activity_cube.GRANULARITIES), index=1)
+        first_date, last_date = df['date'].min().date(), df['date'].max().date()
+        activity_dates = st.sidebar.date_input("Activity between", value=(first_date, last_date),
+                                               min_value=first_date, max_value=last_date)
+        session_gap = st.sidebar.number_input("New conversation after a pause of (minutes)", min_value=1,
+                                              value=conversations.SESSION_GAP_MINUTES)
         st.header("Keyword Search")
         keyword = st.text_input("Enter a keyword:")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            search_mode = st.radio("Match", list(SEARCH_MODES), horizontal=True)
+        with col2:
+            search_users = st.multiselect("From", user_list[1:])
+        with col3:
+            search_dates = st.date_input("Between", value=(first_date, last_date), min_value=first_date,
+                                         max_value=last_date)
         if keyword:
-            filtered_messages = df[df['message'].str.contains(keyword, case=False)]
-            st.dataframe(filtered_messages, use_container_width=True)
+            start = end = None
+            if len(search_dates) == 2 and tuple(search_dates) != (first_date, last_date):
+                start, end = pd.Timestamp(search_dates[0]), pd.Timestamp(search_dates[1]) + pd.Timedelta(days=1)
+            with instrumentation.stage('search') as record:
+                rows = load_search_index(chat_key, df).search(keyword, SEARCH_MODES[search_mode],
+                                                              search_users or None, start, end)
+                record['rows'] = len(rows)
+            st.dataframe(df.iloc[rows], use_container_width=True)
 
         if st.sidebar.button("Show Analysis"):
-            num_messages, words, num_media, num_links = helper.fetch_stats(selected_user, df)
+            import matplotlib.pyplot as plt
+            import seaborn as sns
+            import helper
+            import out_of_core
+            import training_store
+            with instrumentation.stage('analysis', len(df)):
+                results = load_analysis(chat_key, df)[selected_user]
+            num_messages, words, num_media, num_links = results['stats']
             st.title("Statistics")
             col1, col2, col3, col4 = st.columns(4)
             with col1:
@@ -151,33 +269,41 @@ def main():
 
             col1, col2 = st.columns(2)
             with col1:
-                timeline = helper.monthly_timeline(selected_user, df)
+                timeline = results['monthly_timeline']
                 st.header("Monthly Timeline")
                 st.line_chart(timeline.set_index('time')['message'], height=500)
             with col2:
-                daily_timeline = helper.get_daily_timeline(selected_user, df)
+                daily_timeline = results['daily_timeline']
                 st.header("Daily Timeline")
                 st.line_chart(daily_timeline.set_index('only_date')['message'], height=500)
 
+            with instrumentation.stage('activity', len(df)):
+                cube = load_activity(chat_key, df)
+                if len(activity_dates) == 2:
+                    cube = cube.slice(activity_dates[0], activity_dates[1] + pd.Timedelta(days=1))
+                activity = cube.rollup(selected_user, activity_cube.GRANULARITIES[granularity])
+            st.header(f"Activity by {granularity}")
+            st.line_chart(activity.rename('message'), height=500)
+
             st.title("Activity Map")
             col1, col2 = st.columns(2)
             with col1:
                 st.header("Most busy day")
-                busy_day = helper.week_activity_map(selected_user, df)
+                busy_day = results['busy_day']
                 st.bar_chart(busy_day, height=600)
             with col2:
                 st.header("Most busy month")
-                busy_month = helper.month_activity_map(selected_user, df)
+                busy_month = results['busy_month']
                 st.bar_chart(busy_month, height=600)
 
-            user_heatmap = helper.activity_heat_map(selected_user, df)
+            user_heatmap = results['heatmap']
             fig, ax = plt.subplots()
             ax = sns.heatmap(user_heatmap)
             st.header("Activity Heatmap")
             st.pyplot(fig, use_container_width=True)
 
             if selected_user == 'Overall':
-                x, percent_new_df = helper.most_busy_users(df)
+                x, percent_new_df = results['most_busy_users']
                 col1, col2 = st.columns(2)
                 with col1:
                     st.header('Most Busy Users')
@@ -186,20 +312,70 @@ def main():
                     st.header('Percentage of Messages Sent by Each User')
                     st.dataframe(percent_new_df, use_container_width=True, hide_index=True)
 
+            with instrumentation.stage('conversations', len(df)):
+                chat_conversations = load_conversations(chat_key, df, session_gap)
+                sessions = chat_conversations.user_sessions(selected_user)
+                reply_minutes = chat_conversations.median_reply_minutes(selected_user)
+                reply_times = chat_conversations.reply_times()
+                reply_edges = chat_conversations.reply_edges(selected_user)
+            st.title("Conversations")
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.header("Sessions")
+                st.title(len(sessions))
+            with col2:
+                st.header("Median Reply Time")
+                st.title("-" if reply_minutes is None else f"{reply_minutes:.1f} min")
+            with col3:
+                st.header("Messages per Session")
+                st.title(f"{sessions['messages'].median():.0f}" if len(sessions) else "-")
+
+            col1, col2 = st.columns(2)
+            with col1:
+                st.header("Sessions per Month")
+                sessions_per_month = chat_conversations.sessions_per_period(selected_user, 'M')
+                sessions_per_month.index = sessions_per_month.index.start_time
+                st.line_chart(sessions_per_month, height=500)
+            with col2:
+                st.header("Reply Times")
+                if selected_user != 'Overall':
+                    reply_times = reply_times[reply_times['user'] == selected_user]
+                st.dataframe(reply_times, use_container_width=True, hide_index=True)
+
+            col1, col2 = st.columns(2)
+            with col1:
+                st.header("Who Replies to Whom")
+                if reply_edges.empty:
+                    st.write("No replies to show.")
+                elif selected_user == 'Overall':
+                    fig, ax = plt.subplots()
+                    ax = sns.heatmap(chat_conversations.reply_graph(), annot=len(chat_conversations.users) <= 10,
+                                     fmt='d')
+                    st.pyplot(fig, use_container_width=True)
+                else:
+                    st.dataframe(reply_edges, use_container_width=True, hide_index=True)
+            with col2:
+                st.header("Longest Sessions")
+                st.dataframe(sessions.nlargest(20, 'messages'), use_container_width=True, hide_index=True)
+
             st.header("Wordcloud")
-            df_wc = helper.create_wordcloud(selected_user, df)
-            st.image(df_wc.to_array())
+            with instrumentation.stage('wordcloud'):
+                wordcloud_image = load_wordcloud(chat_key, selected_user, *WORDCLOUD_SIZE, results['words'])
+            if wordcloud_image is None:
+                st.write("No words to show.")
+            else:
+                st.image(wordcloud_image)
 
             col1, col2 = st.columns(2)
             with col1:
                 st.header("Most Common Words")
-                most_common_df = helper.most_common_words(selected_user, df)
+                most_common_df = results['most_common_words']
                 st.bar_chart(most_common_df.set_index('Common Word'), height=500)
             with col2:
                 st.header("Most Common Words by Count")
                 st.dataframe(most_common_df, use_container_width=True, hide_index=True)
 
-            emoji_df = helper.get_emojis(selected_user, df)
+            emoji_df = results['emojis']
             st.header("Most Used Emojis")
             col1, col2 = st.columns(2)
             with col1:
@@ -209,8 +385,9 @@ def main():
             with col2:
                 st.dataframe(emoji_df, use_container_width=True, hide_index=True)
 
-            training_data = helper.generate_training_data(df, 'positive-words.txt', 'negative-words.txt',
-                                                          'stop_hinglish.txt')
+            with instrumentation.stage('training_data'):
+                training_data = helper.generate_training_data(df, 'positive-words.txt', 'negative-words.txt',
+                                                              'stop_hinglish.txt')
             X = training_data['message']
             y = training_data['sentiment']
 
@@ -218,41 +395,62 @@ def main():
             sentiment_results_df = pd.DataFrame({'Message': X, 'Sentiment': y})
             st.dataframe(sentiment_results_df, use_container_width=True)
 
-            vectorizer = CountVectorizer()
-            X_vec = vectorizer.fit_transform(X)
-            X_train, X_test, y_train, y_test = train_test_split(X_vec, y, test_size=0.2, random_state=42)
-
-            trained_models = train_models(X_train, y_train, models)
-            evaluate_models(trained_models, X_test, y_test)
+            if featurization == STREAMING_FEATURIZATION:
+                # hashed features and partial_fit models, trained chunk by chunk in bounded memory
+                vectorizer = out_of_core.hashing_vectorizer()
+                st.write(f"Training {', '.join(out_of_core.streaming_models())} on hashed features...")
+                with instrumentation.stage('train_models', len(X)):
+                    trained_models, y_test, predictions = out_of_core.train_streaming(
+                        lambda: out_of_core.iter_chunks(X.values, y.values), out_of_core.streaming_models(),
+                        vectorizer)
+                for model_name in trained_models:
+                    evaluate_model(model_name, y_test, predictions[model_name])
+            else:
+                # fitted vectorizer and models are reused from disk when this data was trained before
+                from sklearn.feature_extraction.text import CountVectorizer
+                import model_registry
+                with instrumentation.stage('train_models', len(X)):
+                    run = model_registry.TrainingRun(X, y, CountVectorizer())
+                    trained_models = train_models(run, classification_models(), training_workers,
+                                                  time_budget or None)
 
             if consent_given:
-                file_path = os.path.join('training_data.csv')
-                if not os.path.exists(file_path):
-                    training_data.to_csv(file_path, index=False)
-                else:
-                    with open(file_path, 'a', encoding='utf-8') as file:
-                        training_data.to_csv(file, mode='a', header=False, index=False)
-            textblob_sentiments = textblob_sentiment_analysis(df['message'])
-
-            # Sentiment analysis using ML models
-            ml_sentiments = {}
-            for model_name, model in trained_models.items():
-                ml_sentiments[model_name] = model.predict(X_vec)
-
-            # Compare sentiment analysis results
-            comparison_results = compare_sentiment_analysis(textblob_sentiments, ml_sentiments, df['message'])
-
-            # Display comparison results
-            st.header("Comparison with TextBlob")
-            for model_name, comparison_df in comparison_results.items():
-                st.subheader(f"Comparison with {model_name}")
-                st.dataframe(comparison_df)
-
-            # Display accuracy comparison
-            accuracy_comparison = display_accuracy_comparison(textblob_sentiments, ml_sentiments)
-            st.header("Accuracy Comparison with TextBlob")
-            for model_name, accuracy in accuracy_comparison.items():
-                st.write(f"{model_name}: {accuracy:.2%}")
+                # append to the deduplicated Parquet corpus, seeding it once from the legacy CSV
+                with instrumentation.stage('training_store', len(training_data)):
+                    if training_store.is_empty() and os.path.exists(training_store.LEGACY_CSV):
+                        training_store.import_csv()
+                    training_store.append(training_data, batch=chat_key)
+                    training_store.compact_in_background()
+            if not trained_models:
+                # every model timed out or failed, so there is nothing to compare with TextBlob
+                st.warning("No model finished training, so there is no comparison with TextBlob.")
+            else:
+                with instrumentation.stage('textblob', len(df)):
+                    textblob_sentiments = textblob_sentiment_analysis(df['message'], training_workers)
+
+                # Sentiment analysis using ML models
+                ml_sentiments = {}
+                with instrumentation.stage('predict', len(X)):
+                    for model_name, model in trained_models.items():
+                        if featurization == STREAMING_FEATURIZATION:
+                            ml_sentiments[model_name] = out_of_core.predict_chunks(model, X.values, vectorizer)
+                        else:
+                            ml_sentiments[model_name] = model.predict(run.X_vec)
+
+                # Compare sentiment analysis results
+                comparison_results = compare_sentiment_analysis(textblob_sentiments, ml_sentiments, df['message'])
+
+                # Display comparison results
+                st.header("Comparison with TextBlob")
+                for model_name, comparison_df in comparison_results.items():
+                    st.subheader(f"Comparison with {model_name}")
+                    st.dataframe(comparison_df)
+
+                # Display accuracy comparison
+                accuracy_comparison = display_accuracy_comparison(textblob_sentiments, ml_sentiments)
+                st.header("Accuracy Comparison with TextBlob")
+                for model_name, accuracy in accuracy_comparison.items():
+                    st.write(f"{model_name}: {accuracy:.2%}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,154 @@
+"""
+Analyze a directory of WhatsApp exports without the Streamlit app.
+
+    python -m batch_analysis EXPORTS_DIR OUTPUT_DIR [--format json|parquet] [--workers N] [--textblob]
+
+Each export (*.txt) is parsed and analyzed in a worker process with the same code as the app
+(preprocessor, analysis, sentiment and polarity), and its results are written to
+OUTPUT_DIR/<export name>/: summary.json with the statistics and sentiment summaries, and one
+table per file (timelines, activity maps, word and emoji counts) as JSON or Parquet.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import os
+import sys
+import pandas as pd
+import analysis
+import chat_cache
+import preprocessor
+import sentiment
+from user_index import OVERALL
+
+FORMATS = ('json', 'parquet')
+
+
+def _table(bundle, name):
+    # one long frame for every user, with the user as the first column
+    frames = []
+    for user, results in bundle.items():
+        table = results[name]
+        if name == 'heatmap':
+            table = table.stack().rename('message').reset_index()
+        elif isinstance(table, pd.Series):
+            table = table.rename('message').reset_index()
+        frames.append(table.assign(user=user)[['user'] + list(table.columns)])
+    return pd.concat(frames, ignore_index=True)
+
+
+def _counts(counters, column):
+    rows = [(user, key, count) for user, counter in counters.items() for key, count in counter.most_common()]
+    return pd.DataFrame(rows, columns=['user', column, 'count'])
+
+
+def _sentiment_summary(df, labels):
+    counts = pd.crosstab(df['user'].to_numpy(), pd.Categorical(labels, sentiment.SENTIMENTS))
+    summary = {user: {label: int(count) for label, count in row.items()} for user, row in counts.iterrows()}
+    summary[OVERALL] = {label: int(count) for label, count in counts.sum().items()}
+    return summary
+
+
+def analyze_export(path, textblob=False, cache_dir=None):
+    """
+    Parse and analyze one export, returning (summary, tables): a JSON-serializable dict of
+    statistics and sentiment counts per user, and {name: DataFrame}.
+    """
+    with open(path, 'rb') as file:
+        raw = file.read()
+    if cache_dir is None:
+        df = preprocessor.preprocess(raw)
+        aggregates = analysis.aggregate(df)
+    else:
+        key = chat_cache.content_hash(raw)
+        df = chat_cache.load_chat(raw, cache_dir, key=key)
+        aggregates = chat_cache.load_aggregates(key, df, cache_dir)
+    bundle = analysis.build_bundle(aggregates)
+
+    text = sentiment.text_messages(df)
+    stats = {user: dict(zip(('messages', 'words', 'media', 'links'), map(int, results['stats'])))
+             for user, results in bundle.items()}
+    summary = {
+        'export': os.path.basename(path),
+        'messages': len(df),
+        'first_message': df['date'].min().isoformat(),
+        'last_message': df['date'].max().isoformat(),
+        'stats': stats,
+        # the same rows as the app's training data, so the counts match its sentiment table
+        'sentiment': _sentiment_summary(text, sentiment.label_messages(text['message'])['sentiment']),
+    }
+    if textblob:
+        # imported here so runs without --textblob do not load TextBlob
+        import polarity
+        summary['textblob_sentiment'] = _sentiment_summary(df, polarity.label_messages(df['message']))
+
+    tables = {name: _table(bundle, name) for name in analysis.TABLES}
+    tables['words'] = _counts(aggregates['words'], 'word')
+    tables['emojis'] = _counts(aggregates['emojis'], 'emoji')
+    return summary, tables
+
+
+def write_results(summary, tables, directory, output_format='json'):
+    """
+    Write summary.json and one <table>.json or <table>.parquet file per table to directory.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'summary.json'), 'w', encoding='utf-8') as file:
+        json.dump(summary, file, ensure_ascii=False, indent=2)
+    for name, table in tables.items():
+        path = os.path.join(directory, '%s.%s' % (name, output_format))
+        if output_format == 'parquet':
+            table.to_parquet(path, index=False)
+        else:
+            table.to_json(path, orient='records', date_format='iso', force_ascii=False)
+
+
+def _process(path, output_dir, output_format, textblob, cache_dir):
+    summary, tables = analyze_export(path, textblob, cache_dir)
+    name = os.path.splitext(os.path.basename(path))[0]
+    write_results(summary, tables, os.path.join(output_dir, name), output_format)
+    return summary['messages']
+
+
+def analyze_directory(exports_dir, output_dir, output_format='json', workers=None, textblob=False,
+                      cache_dir=None):
+    """
+    Analyze every *.txt export of a directory in a process pool, yielding (path, messages, error)
+    as each one finishes; error is None on success and messages None on failure.
+    """
+    if output_format not in FORMATS:
+        raise ValueError("Unknown output format: " + output_format)
+    paths = sorted(os.path.join(exports_dir, name) for name in os.listdir(exports_dir) if name.endswith('.txt'))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_process, path, output_dir, output_format, textblob, cache_dir): path
+                   for path in paths}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as error:
+                yield futures[future], None, repr(error)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m batch_analysis',
+                                     description="Analyze a directory of WhatsApp chat exports.")
+    parser.add_argument('exports_dir', help="directory of exported chats (*.txt)")
+    parser.add_argument('output_dir', help="directory to write one result directory per chat to")
+    parser.add_argument('--format', choices=FORMATS, default='json', help="table file format")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument('--textblob', action='store_true', help="also summarize TextBlob polarity labels")
+    parser.add_argument('--cache-dir', default=None, help="reuse and fill the app's parsed chat cache here")
+    args = parser.parse_args(argv)
+
+    failed = 0
+    for path, messages, error in analyze_directory(args.exports_dir, args.output_dir, args.format, args.workers,
+                                                   args.textblob, args.cache_dir):
+        if error is None:
+            print("%s: %d messages" % (path, messages))
+        else:
+            failed += 1
+            print("%s: failed: %s" % (path, error), file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,52 @@
+"""
+Compare the emoji counting in emojis.py with the previous per-character EMOJI_DATA lookup.
+
+Run from the repository root: python -m benchmarks.bench_emojis [num_messages]
+"""
+from collections import Counter
+import random
+import sys
+import time
+import emoji
+import emojis
+
+WORDS = ['hello', 'ok', 'haha', 'kya', 'scene', 'hai', 'bhai', 'kal', 'milte', 'the', 'party', '12:30', '#1']
+EMOJIS = ['😂', '❤️', '👍🏽', '🙏', '👨‍👩‍👧', '🇮🇳', '🔥', '1️⃣']
+
+
+def synthetic_messages(num_messages, emoji_rate=0.3, seed=0):
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(num_messages):
+        message = [rng.choice(WORDS) for _ in range(rng.randint(1, 12))]
+        if rng.random() < emoji_rate:
+            message.append(rng.choice(EMOJIS) * rng.randint(1, 3))
+        messages.append(' '.join(message) + '\n')
+    return messages
+
+
+def legacy_count(messages):
+    found = []
+    for message in messages:
+        found.extend([c for c in message if c in emoji.EMOJI_DATA.keys()])
+    return Counter(found)
+
+
+def timed(function, messages):
+    start = time.perf_counter()
+    result = function(messages)
+    return time.perf_counter() - start, result
+
+
+def main(num_messages=200000):
+    messages = synthetic_messages(num_messages)
+    legacy_time, legacy = timed(legacy_count, messages)
+    new_time, new = timed(emojis.count_emojis, messages)
+    print(f"messages: {num_messages}")
+    print(f"legacy per-character lookup: {legacy_time:.3f}s, {sum(legacy.values())} emojis, {len(legacy)} distinct")
+    print(f"trie scan: {new_time:.3f}s, {sum(new.values())} emojis, {len(new)} distinct")
+    print(f"speedup: {legacy_time / new_time:.1f}x")
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,48 @@
+"""
+Report the import time of the app's modules with python -X importtime, and which heavy libraries
+importing them pulls in. Each module is imported in a fresh interpreter, best of a few runs.
+
+Run from the repository root: python -m benchmarks.bench_imports [runs] [module ...]
+Exits with status 1 if importing app loads one of the heavy libraries.
+"""
+import subprocess
+import sys
+
+MODULES = ['app', 'chat_cache', 'analysis', 'batch_analysis', 'helper']
+
+# Libraries the upload page should not need; importing app must not load any of them
+HEAVY = ['sklearn', 'scipy', 'matplotlib', 'seaborn', 'wordcloud', 'textblob', 'nltk', 'joblib', 'pyarrow.dataset']
+
+
+def import_times(module):
+    """
+    Return ({imported module: cumulative microseconds}, total microseconds) for importing module.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                            capture_output=True, text=True, check=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = int(cumulative)
+    return modules, modules.get(module, 0)
+
+
+def main(runs=3, *modules):
+    regressions = []
+    for module in modules or MODULES:
+        imported, total = min((import_times(module) for _ in range(runs)), key=lambda times: times[1])
+        heavy = [name for name in HEAVY if name in imported]
+        packages = {name: cumulative for name, cumulative in imported.items() if '.' not in name and name != module}
+        print(f"{module}: {total / 1000:.0f} ms")
+        for name, cumulative in sorted(packages.items(), key=lambda item: -item[1])[:8]:
+            print(f"  {name}: {cumulative / 1000:.0f} ms")
+        print(f"  heavy libraries: {', '.join(heavy) or 'none'}")
+        if module == 'app' and heavy:
+            regressions.append(module)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(arg) for arg in sys.argv[1:2]], *sys.argv[2:]))
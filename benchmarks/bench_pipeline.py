@@ -0,0 +1,189 @@
+"""
+Time and memory-profile every stage of the analysis pipeline on synthetic exports.
+
+Run from the repository root:
+python -m benchmarks.bench_pipeline [--sizes 1000 100000 ...] [--formats android ios] [--stages parse ...]
+                                    [--users N] [--emoji-rate R] [--link-rate R] [--multiline-rate R]
+                                    [--output results.jsonl]
+
+Every (size, format, stage) gives one JSON line with wall and CPU seconds, the peak resident memory
+growth during the stage and the rows it processed, written to --output (or stdout); a readable table
+goes to stderr. Stages run in order and the ones a requested stage depends on run too.
+"""
+import argparse
+from collections import Counter
+import json
+import os
+import platform
+import sys
+import tempfile
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.naive_bayes import MultinomialNB
+import analysis
+from benchmarks import synthetic_chat
+import conversations
+import helper
+import instrumentation
+import model_registry
+import out_of_core
+import polarity
+import preprocessor
+import search_index
+import sentiment
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+
+def _parse(context):
+    with open(context['path'], 'rb') as file:
+        context['df'] = preprocessor.preprocess(file)
+    return len(context['df'])
+
+
+def _aggregate(context):
+    context['aggregates'] = analysis.aggregate(context['df'])
+    return len(context['df'])
+
+
+def _bundle(context):
+    return len(analysis.build_bundle(context['aggregates']))
+
+
+def _search_index(context):
+    index = search_index.SearchIndex(context['df'])
+    return len(index.vocabulary)
+
+
+def _conversations(context):
+    result = conversations.build_conversations(context['df'])
+    result.reply_times()
+    result.reply_graph()
+    return len(context['df'])
+
+
+def _wordcloud(context):
+    words = sum(context['aggregates']['words'].values(), Counter())
+    helper.render_wordcloud(words)
+    return len(words)
+
+
+def _training_data(context):
+    context['training_data'] = sentiment.label_messages(context['df']['message'])
+    return len(context['training_data'])
+
+
+def _textblob(context):
+    return len(polarity.label_messages(context['df']['message'], cache=polarity.LabelCache()))
+
+
+def _train_count(context):
+    training_data = context['training_data']
+    with tempfile.TemporaryDirectory() as directory:
+        run = model_registry.TrainingRun(training_data['message'], training_data['sentiment'], CountVectorizer(),
+                                         directory=directory)
+        for model in (LogisticRegression(max_iter=1000), MultinomialNB()):
+            run.fit(model)
+    return len(training_data)
+
+
+def _train_streaming(context):
+    training_data = context['training_data']
+    messages, labels = training_data['message'].to_numpy(), training_data['sentiment'].to_numpy()
+    out_of_core.train_streaming(lambda: out_of_core.iter_chunks(messages, labels), out_of_core.streaming_models(),
+                                out_of_core.hashing_vectorizer())
+    return len(training_data)
+
+
+# name -> (stage, names of the stages it needs)
+STAGES = {
+    'parse': (_parse, []),
+    'aggregate': (_aggregate, ['parse']),
+    'bundle': (_bundle, ['aggregate']),
+    'search_index': (_search_index, ['parse']),
+    'conversations': (_conversations, ['parse']),
+    'wordcloud': (_wordcloud, ['aggregate']),
+    'training_data': (_training_data, ['parse']),
+    'textblob': (_textblob, ['parse']),
+    'train_count': (_train_count, ['training_data']),
+    'train_streaming': (_train_streaming, ['training_data']),
+}
+
+
+def with_dependencies(names):
+    """
+    The requested stages plus every stage they need, in pipeline order.
+    """
+    needed = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name not in needed:
+            needed.add(name)
+            pending.extend(STAGES[name][1])
+    return [name for name in STAGES if name in needed]
+
+
+def run_stage(name, context):
+    """
+    Run one stage, returning its measurements.
+    """
+    stage, _ = STAGES[name]
+    with instrumentation.measure(name) as record:
+        record['rows'] = stage(context)
+    return record
+
+
+def run(sizes=DEFAULT_SIZES, formats=synthetic_chat.FORMATS, stages=tuple(STAGES), data_dir=None, **options):
+    """
+    Benchmark the stages on a synthetic export of each size and format, yielding one result dict
+    per stage. Exports are generated into data_dir (a temporary directory by default) and reused.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = data_dir or tmp_dir
+        os.makedirs(data_dir, exist_ok=True)
+        for size in sizes:
+            for export_format in formats:
+                name = '%s-%d-%s.txt' % (export_format, size, '-'.join('%s=%s' % item for item in sorted(options.items())))
+                path = os.path.join(data_dir, name)
+                if not os.path.exists(path):
+                    synthetic_chat.write_export(path, size, export_format=export_format, **options)
+                context = {'path': path}
+                for stage in with_dependencies(stages):
+                    result = {'messages': size, 'format': export_format, 'export_mb': round(os.path.getsize(path) / 1024 ** 2, 3)}
+                    result.update(options)
+                    result.update(run_stage(stage, context))
+                    result['python'] = platform.python_version()
+                    yield result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.bench_pipeline')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="messages per export")
+    parser.add_argument('--formats', nargs='+', choices=synthetic_chat.FORMATS, default=list(synthetic_chat.FORMATS))
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=list(STAGES))
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--emoji-rate', type=float, default=0.2)
+    parser.add_argument('--link-rate', type=float, default=0.03)
+    parser.add_argument('--multiline-rate', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=None, help="keep generated exports here and reuse them")
+    parser.add_argument('--output', default=None, help="JSON lines file to append results to (default: stdout)")
+    args = parser.parse_args(argv)
+
+    output = open(args.output, 'a', encoding='utf-8') if args.output else sys.stdout
+    try:
+        for result in run(args.sizes, args.formats, args.stages, args.data_dir, users=args.users,
+                          emoji_rate=args.emoji_rate, link_rate=args.link_rate,
+                          multiline_rate=args.multiline_rate, seed=args.seed):
+            output.write(json.dumps(result) + '\n')
+            output.flush()
+            print(f"{result['format']:>8} {result['messages']:>9} {result['stage']:<16} {result['wall_s']:>9.3f}s wall "
+                  f"{result['cpu_s']:>9.3f}s cpu {result['peak_rss_delta_mb']:>9.1f} MB", file=sys.stderr)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
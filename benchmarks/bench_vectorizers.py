@@ -0,0 +1,63 @@
+"""
+Compare peak memory, time and accuracy of the in-memory CountVectorizer path with the streaming
+feature hashing path of out_of_core.py, on training_data.csv repeated to the requested size.
+
+Run from the repository root: python -m benchmarks.bench_vectorizers [copies]
+"""
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.metrics import accuracy_score
+from sklearn.naive_bayes import MultinomialNB
+import model_registry
+import out_of_core
+
+
+def load_corpus(copies):
+    corpus = pd.read_csv('training_data.csv', encoding_errors='replace').dropna()
+    messages = corpus['message'].astype(str).to_numpy()
+    labels = corpus['sentiment'].to_numpy()
+    # append rare tokens (names, typos, links...) so the vocabulary grows with the corpus like a real one would
+    messages = np.tile(messages, copies)
+    messages = np.array([message + ' x%x' % (row * 7919 % (len(messages) // 2 + 1))
+                         for row, message in enumerate(messages)], dtype=object)
+    return messages, np.tile(labels, copies)
+
+
+def count_vectorizer_path(messages, labels):
+    test = model_registry.row_hashes(messages, labels) % model_registry.TEST_MODULUS == 0
+    X = CountVectorizer().fit_transform(messages)
+    model = MultinomialNB().fit(X[~test], labels[~test])
+    return accuracy_score(labels[test], model.predict(X[test]))
+
+
+def streaming_path(messages, labels):
+    models, y_test, predictions = out_of_core.train_streaming(
+        lambda: out_of_core.iter_chunks(messages, labels), {'nb': MultinomialNB()})
+    return accuracy_score(y_test, predictions['nb'])
+
+
+def measure(function, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    accuracy = function(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, accuracy
+
+
+def main(copies=4):
+    messages, labels = load_corpus(copies)
+    print(f"messages: {len(messages)}")
+    for name, function in [('CountVectorizer + MultinomialNB', count_vectorizer_path),
+                           ('HashingVectorizer + partial_fit MultinomialNB', streaming_path)]:
+        elapsed, peak, accuracy = measure(function, messages, labels)
+        print(f"{name}: {elapsed:.2f}s, peak {peak / 1024 ** 2:.1f} MiB, accuracy {accuracy:.3f}")
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
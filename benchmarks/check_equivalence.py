@@ -0,0 +1,162 @@
+"""
+Check that the single-pass parser finds the same messages, and that the vectorized link counting,
+training data labelling and TextBlob labelling give exactly the results of the previous
+per-message code, kept below as the reference.
+
+Run from the repository root: python -m benchmarks.check_equivalence [PATH ...]
+
+PATH is a chat export (.txt) or a CSV with a message column such as training_data.csv; the
+default is the fixture export benchmarks/fixtures/chat.txt. Exits with status 1 on a mismatch.
+"""
+from collections import defaultdict
+import os
+import re
+import sys
+import pandas as pd
+from textblob import TextBlob
+from urlextract import URLExtract
+import analysis
+import lexicons
+import links
+import polarity
+import preprocessor
+import sentiment
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'chat.txt')
+
+# Small chunks, so the process pool paths are checked on small inputs too
+CHUNK_SIZE = 200
+
+
+def legacy_parse(data):
+    # Only the message boundaries are compared: the old parser left a trailing left-to-right mark on
+    # the message before an iOS attachment line, and truncated messages with a second ': '.
+    pattern1 = r'\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}\s-\s'
+    pattern2 = r'\[\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}:\d{2}\s[AP]M\]\s'
+    messages = re.split(pattern1, data)[1:]
+    dates = re.findall(pattern1, data)
+    date_format = r'%d/%m/%Y, %H:%M -'
+    if not dates:
+        messages = re.split(pattern2, data)[1:]
+        dates = re.findall(pattern2, data)
+        date_format = r'[%d/%m/%y, %I:%M:%S %p]'
+    users = []
+    for message in messages:
+        entry = re.split(r'([\w\W]+?):\s', message)
+        users.append(entry[1] if entry[1:] else 'group notification')
+    dates = pd.to_datetime(pd.Series(dates, dtype=object).str.strip(), format=date_format)
+    return dates.tolist(), users
+
+
+def legacy_link_counts(messages):
+    extract = URLExtract()
+    return [len(extract.find_urls(message)) for message in messages]
+
+
+def legacy_remove_emojis(text):
+    # the pattern itself is unchanged, only compiled once now
+    return sentiment.EMOJI_PATTERN.sub(r'', text)
+
+
+def legacy_training_data(messages):
+    with open(lexicons.POSITIVE_WORDS_FILE, 'r', encoding='utf-8') as file:
+        positive_words = file.read().splitlines()
+    with open(lexicons.NEGATIVE_WORDS_FILE, 'r', encoding='utf-8') as file:
+        negative_words = file.read().splitlines()
+    with open(lexicons.STOP_WORDS_FILE, 'r', encoding='utf-8') as file:
+        stop_words = file.read().splitlines()
+
+    training_data = defaultdict(list)
+    for message in messages:
+        message = legacy_remove_emojis(message)
+        message = re.sub(r'http\S+', '', message)
+        message = re.sub(r'\d+', '', message)
+        message = ' '.join(word for word in message.split() if word.lower() not in stop_words)
+        positive_count = sum(1 for word in message.split() if word in positive_words)
+        negative_count = sum(1 for word in message.split() if word in negative_words)
+        if positive_count > negative_count:
+            label = 'positive'
+        elif negative_count > positive_count:
+            label = 'negative'
+        else:
+            label = 'neutral'
+        training_data['message'].append(message)
+        training_data['sentiment'].append(label)
+    return pd.DataFrame(training_data)
+
+
+def legacy_textblob(messages):
+    sentiments = []
+    for message in messages:
+        polarity_score = TextBlob(message).sentiment.polarity
+        if polarity_score > 0:
+            sentiments.append('positive')
+        elif polarity_score < 0:
+            sentiments.append('negative')
+        else:
+            sentiments.append('neutral')
+    return sentiments
+
+
+def load_messages(path):
+    """
+    The messages of a chat export, or of the message column of a CSV.
+    """
+    if path.endswith('.csv'):
+        df = pd.read_csv(path, encoding_errors='replace')
+        return df['message'].dropna().astype(str).reset_index(drop=True)
+    with open(path, 'rb') as file:
+        df = preprocessor.preprocess(file)
+    return df['message']
+
+
+def check_parse(path):
+    """
+    Whether the parser finds the messages of a chat export at the dates and users the old one did.
+    """
+    with open(path, 'rb') as file:
+        df = preprocessor.preprocess(file)
+    with open(path, 'r', encoding='utf-8', newline='') as file:
+        dates, users = legacy_parse(file.read())
+    return df['date'].tolist() == dates and df['user'].tolist() == users
+
+
+def check(path):
+    """
+    Compare every pipeline with its reference on one file, returning the names of those that differ.
+    """
+    messages = load_messages(path)
+    failures = []
+
+    if not path.endswith('.csv') and not check_parse(path):
+        failures.append('parsed messages')
+
+    counts = links.link_counts(messages)
+    if counts.tolist() != legacy_link_counts(messages):
+        failures.append('link counts')
+
+    text = messages[messages != analysis.MEDIA_MESSAGE]
+    expected = legacy_training_data(text)
+    for processes in (1, 2):
+        labelled = sentiment.label_messages(text, processes=processes, chunk_size=CHUNK_SIZE)
+        if not labelled.equals(expected):
+            failures.append('training data (%d processes)' % processes)
+
+    expected = legacy_textblob(messages)
+    for processes in (1, 2):
+        labels = polarity.label_messages(messages, processes, CHUNK_SIZE, cache=polarity.LabelCache())
+        if list(labels) != expected:
+            failures.append('TextBlob labels (%d processes)' % processes)
+
+    print(f"{path}: {len(messages)} messages, {int(counts.sum())} links: "
+          f"{'mismatch in ' + ', '.join(failures) if failures else 'identical'}")
+    return failures
+
+
+def main(*paths):
+    failed = [path for path in paths or [FIXTURE] if check(path)]
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*sys.argv[1:]))
@@ -0,0 +1,93 @@
+"""
+Deterministic synthetic WhatsApp exports in both supported formats, for benchmarks.
+
+Write one from the repository root:
+python -m benchmarks.synthetic_chat PATH [num_messages] [android|ios]
+"""
+from datetime import datetime, timedelta
+import random
+import sys
+
+FORMATS = ('android', 'ios')
+
+WORDS = ['hello', 'ok', 'haha', 'kya', 'scene', 'hai', 'bhai', 'kal', 'milte', 'the', 'party', 'good', 'bad',
+         'love', 'great', 'sorry', 'yaar', 'nahi', 'chalo', 'done', 'thanks', 'late', 'morning', 'night', 'where',
+         'are', 'you', 'coming', 'today', 'tomorrow', 'awesome', 'worst', 'happy', 'sad', 'lol', 'acha', 'theek']
+EMOJIS = ['😂', '❤️', '👍🏽', '🙏', '👨‍👩‍👧', '🇮🇳', '🔥', '😭', '🎉', '1️⃣']
+DOMAINS = ['example.com', 'youtu.be', 'news.example.org', 'maps.example.net']
+NOTIFICATIONS = ['Messages and calls are end-to-end encrypted.', '{user} added {other}', '{user} left',
+                 '{user} changed the group description']
+MEDIA_MESSAGE = '<Media omitted>'
+
+
+def _header(date, user, export_format):
+    if export_format == 'android':
+        stamp = '%d/%d/%d, %02d:%02d - ' % (date.day, date.month, date.year, date.hour, date.minute)
+    else:
+        hour = date.hour % 12 or 12
+        stamp = '[%02d/%02d/%02d, %d:%02d:%02d %s] ' % (date.day, date.month, date.year % 100, hour, date.minute,
+                                                        date.second, 'AM' if date.hour < 12 else 'PM')
+    return stamp if user is None else stamp + user + ': '
+
+
+def iter_export(num_messages, users=5, export_format='android', multiline_rate=0.05, emoji_rate=0.2,
+                link_rate=0.03, media_rate=0.05, notification_rate=0.01, days=730, seed=0,
+                start=datetime(2021, 1, 1)):
+    """
+    Yield the lines of a chat export of num_messages messages spread over about days days,
+    without holding it in memory. The same arguments always produce the same export.
+    """
+    if export_format not in FORMATS:
+        raise ValueError("Unknown export format: " + export_format)
+    rng = random.Random(seed)
+    names = ['User %d' % number for number in range(1, users + 1)]
+    mean_gap = days * 86400 / max(num_messages, 1)
+    date = start
+    for _ in range(num_messages):
+        # mostly bursts of replies, with a few long pauses that make up most of the elapsed time
+        if rng.random() < 0.9:
+            gap = rng.expovariate(1 / (mean_gap * 0.1))
+        else:
+            gap = rng.expovariate(1 / (mean_gap * 9.1))
+        date += timedelta(seconds=gap)
+        if rng.random() < notification_rate:
+            text = rng.choice(NOTIFICATIONS).format(user=rng.choice(names), other=rng.choice(names))
+            yield _header(date, None, export_format) + text + '\n'
+            continue
+
+        user = rng.choice(names)
+        if rng.random() < media_rate:
+            yield _header(date, user, export_format) + MEDIA_MESSAGE + '\n'
+            continue
+        words = [rng.choice(WORDS) for _ in range(rng.randint(1, 15))]
+        if rng.random() < emoji_rate:
+            words.insert(rng.randint(0, len(words)), rng.choice(EMOJIS) * rng.randint(1, 3))
+        if rng.random() < link_rate:
+            words.append('https://%s/%x' % (rng.choice(DOMAINS), rng.getrandbits(32)))
+        lines = [' '.join(words)]
+        if rng.random() < multiline_rate:
+            lines.extend(' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 8)))
+                         for _ in range(rng.randint(1, 4)))
+        yield _header(date, user, export_format) + lines[0] + '\n'
+        for line in lines[1:]:
+            yield line + '\n'
+
+
+def export_text(num_messages, **options):
+    """
+    A whole synthetic export as one string.
+    """
+    return ''.join(iter_export(num_messages, **options))
+
+
+def write_export(path, num_messages, **options):
+    """
+    Write a synthetic export to path line by line, so even 10M messages fit in memory.
+    """
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        file.writelines(iter_export(num_messages, **options))
+
+
+if __name__ == '__main__':
+    write_export(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 100000,
+                 export_format=sys.argv[3] if len(sys.argv) > 3 else 'android')
@@ -0,0 +1,256 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import pandas as pd
+import pyarrow.feather as feather
+import analysis
+import preprocessor
+import search_index
+
+# Parsed chats are stored as uncompressed Feather files so they can be memory mapped on load
+CACHE_DIR = os.environ.get('CHAT_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'whatsapp-chat-analyzer'))
+MAX_CACHE_BYTES = int(os.environ.get('CHAT_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+CHUNK_SIZE = 1024 * 1024
+AGGREGATES_SUFFIX = 'aggregates%d.pickle' % analysis.AGGREGATES_VERSION
+SEARCH_INDEX_SUFFIX = 'search%d.pickle' % search_index.SEARCH_INDEX_VERSION
+
+
+def content_hash(data):
+    """
+    Hash the raw bytes of an export given as str, bytes or a binary file object.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        digest.update(data)
+    else:
+        data.seek(0)
+        for chunk in iter(lambda: data.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+        data.seek(0)
+    return digest.hexdigest()
+
+
+def read_bytes(data):
+    """
+    The raw bytes of an export given as str, bytes or a binary file object.
+    """
+    if isinstance(data, str):
+        return data.encode('utf-8')
+    if isinstance(data, (bytes, bytearray)):
+        return data
+    if hasattr(data, 'getvalue'):
+        return data.getvalue()
+    data.seek(0)
+    raw = data.read()
+    data.seek(0)
+    return raw
+
+
+def cache_path(key, cache_dir=CACHE_DIR, suffix='chat.feather'):
+    """
+    Path of the cached file for a content hash, tagged with the parser schema version.
+    """
+    return os.path.join(cache_dir, '%s-v%d.%s' % (key, preprocessor.SCHEMA_VERSION, suffix))
+
+
+def read_frame(path):
+    """
+    Load a cached frame with memory mapping, or return None if it is missing or unreadable.
+    """
+    try:
+        df = feather.read_table(path, memory_map=True).to_pandas()
+    except (OSError, ValueError):
+        return None
+    # refresh the access time so eviction keeps recently used chats
+    os.utime(path)
+    return df
+
+
+def write_atomic(path, write, max_bytes, versioned=True):
+    """
+    Write a file through write(tmp_path) and move it into place, then evict the cache directory.
+    The temporary file has a unique name, so sessions writing the same file do not collide.
+    """
+    cache_dir = os.path.dirname(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    evict(cache_dir, max_bytes, keep=path, versioned=versioned)
+
+
+def write_frame(path, df, max_bytes=MAX_CACHE_BYTES):
+    """
+    Atomically store a frame and evict least recently used files beyond max_bytes.
+    """
+    write_atomic(path, lambda tmp_path: feather.write_feather(df.reset_index(drop=True), tmp_path,
+                                                               compression='uncompressed'), max_bytes)
+
+
+def read_pickle(path):
+    try:
+        with open(path, 'rb') as file:
+            value = pickle.load(file)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    os.utime(path)
+    return value
+
+
+def write_pickle(path, value, max_bytes=MAX_CACHE_BYTES):
+    def write(tmp_path):
+        with open(tmp_path, 'wb') as file:
+            pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    write_atomic(path, write, max_bytes)
+
+
+def evict(cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES, keep=None, versioned=True):
+    """
+    Drop files written by older parser versions (unless versioned is False), then the least
+    recently used ones until the cache fits in max_bytes.
+    """
+    current = '-v%d.' % preprocessor.SCHEMA_VERSION
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if not entry.is_file() or entry.name.endswith('.tmp'):
+            continue
+        try:
+            if versioned and current not in entry.name:
+                os.remove(entry.path)
+                continue
+            stat = entry.stat()
+        except FileNotFoundError:
+            # another session evicted it first
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def head_key(raw):
+    """
+    Identify a chat by the hash of its first line, which stays the same as the export grows.
+    """
+    return content_hash(memoryview(raw)[:raw.find(b'\n') + 1])
+
+
+def write_manifest(raw, key, df, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    """
+    Record the newest ingested export of a chat: its content hash and length, and where and when
+    its last message starts, so the next, longer export of the chat can be parsed from there.
+    """
+    offset = preprocessor.last_message_offset(raw)
+    if offset is None:
+        return
+    manifest = {'key': key, 'length': len(raw), 'last_offset': offset, 'last_date': df['date'].iloc[-1].isoformat()}
+    path = cache_path(head_key(raw), cache_dir, 'manifest.json')
+    write_atomic(path, lambda tmp_path: dump_json(manifest, tmp_path), max_bytes)
+
+
+def dump_json(value, path):
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(value, file)
+
+
+def _read_manifest(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def extend_chat(raw, key, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    """
+    If raw extends a previously ingested export of the same chat, parse only the new tail, store
+    the merged frame (and merged aggregates, if the previous ones are cached) under key and return
+    it. Returns None when the export is not an extension of a cached one.
+    """
+    manifest = _read_manifest(cache_path(head_key(raw), cache_dir, 'manifest.json'))
+    if manifest is None or len(raw) <= manifest['length']:
+        return None
+    if content_hash(memoryview(raw)[:manifest['length']]) != manifest['key']:
+        return None
+    previous = read_frame(cache_path(manifest['key'], cache_dir))
+    if previous is None:
+        return None
+
+    # the tail starts at the last known message, which must parse back to exactly the stored row
+    tail = preprocessor.preprocess(raw[manifest['last_offset']:])
+    first, last = tail.iloc[0], previous.iloc[-1]
+    if first['date'].isoformat() != manifest['last_date'] or \
+            (first['date'], first['user'], first['message']) != (last['date'], last['user'], last['message']):
+        return None
+
+    new_rows = tail.iloc[1:].reset_index(drop=True)
+    df = pd.concat([previous, new_rows], ignore_index=True)
+    write_frame(cache_path(key, cache_dir), df, max_bytes)
+
+    aggregates = read_pickle(cache_path(manifest['key'], cache_dir, AGGREGATES_SUFFIX))
+    if aggregates is not None:
+        aggregates = analysis.merge(aggregates, analysis.aggregate(new_rows))
+        write_pickle(cache_path(key, cache_dir, AGGREGATES_SUFFIX), aggregates, max_bytes)
+    return df
+
+
+def load_chat(data, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES, key=None):
+    """
+    Return the parsed DataFrame for an export, parsing it only if no cached copy exists, and only
+    its new messages if it extends a cached export of the same chat.
+    """
+    if key is None:
+        key = content_hash(data)
+    path = cache_path(key, cache_dir)
+    df = read_frame(path)
+    if df is None:
+        raw = read_bytes(data)
+        df = extend_chat(raw, key, cache_dir, max_bytes)
+        if df is None:
+            df = preprocessor.preprocess(raw)
+            write_frame(path, df, max_bytes)
+        write_manifest(raw, key, df, cache_dir, max_bytes)
+    return df
+
+
+def load_aggregates(key, df, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    """
+    Return the analysis aggregates of a parsed chat, computing and caching them on a miss.
+    """
+    path = cache_path(key, cache_dir, AGGREGATES_SUFFIX)
+    aggregates = read_pickle(path)
+    if aggregates is None:
+        aggregates = analysis.aggregate(df)
+        write_pickle(path, aggregates, max_bytes)
+    return aggregates
+
+
+def load_search_index(key, df, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    """
+    Return the keyword search index of a parsed chat, building and caching it on a miss.
+    """
+    path = cache_path(key, cache_dir, SEARCH_INDEX_SUFFIX)
+    index = read_pickle(path)
+    if index is None:
+        index = search_index.SearchIndex(df)
+        write_pickle(path, index, max_bytes)
+    return index.attach(df)
@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+from user_index import GROUP_NOTIFICATION, OVERALL, user_index
+
+# A pause longer than this many minutes ends a conversation session
+SESSION_GAP_MINUTES = 30
+
+SESSION_COLUMNS = ['start', 'end', 'duration_minutes', 'messages', 'participants', 'initiator']
+
+
+class Conversations:
+    """
+    Sessions, replies and the reply graph of a chat, from its messages in date order without
+    group notifications. A session is a run of messages with no pause longer than the session
+    gap; a reply is a message that follows another user's message in the same session, and its
+    latency is the time since that message. Everything is computed with shifts, diffs and bincounts
+    over the whole chat, in time linear in the number of messages.
+    """
+
+    def __init__(self, users, codes, seconds, gap_minutes=SESSION_GAP_MINUTES):
+        self.users = list(users)
+        self.code_of = {user: code for code, user in enumerate(self.users)}
+        self.gap_minutes = gap_minutes
+        num_users = len(self.users)
+
+        new_session = np.ones(len(codes), dtype=bool)
+        pauses = np.diff(seconds)
+        new_session[1:] = pauses > gap_minutes * 60
+        starts = np.flatnonzero(new_session)
+        # without messages there are no sessions, rather than one ending at message -1
+        ends = np.append(starts[1:], len(codes))[:len(starts)] - 1
+        session = np.cumsum(new_session) - 1
+
+        # each (session, user) pair once, in order of the user's first message in the session
+        pairs = pd.unique(session * num_users + codes)
+        self.session_pairs = (pairs // num_users, pairs % num_users) if num_users else (pairs, pairs)
+        self.sessions = pd.DataFrame({
+            'start': pd.to_datetime(seconds[starts], unit='s'),
+            'end': pd.to_datetime(seconds[ends], unit='s'),
+            'duration_minutes': (seconds[ends] - seconds[starts]) / 60,
+            'messages': ends - starts + 1,
+            'participants': np.bincount(self.session_pairs[0], minlength=len(starts)),
+            'initiator': pd.Categorical.from_codes(codes[starts], self.users),
+        }, columns=SESSION_COLUMNS)
+
+        is_reply = ~new_session[1:] & (codes[1:] != codes[:-1])
+        self.replier = codes[1:][is_reply]
+        self.replied_to = codes[:-1][is_reply]
+        self.latency = pauses[is_reply]
+        self.sessions_started = np.bincount(codes[starts], minlength=num_users)
+        self.sessions_joined = np.bincount(self.session_pairs[1], minlength=num_users)
+
+    def _code(self, user):
+        return self.code_of.get(user, -1)
+
+    def reply_latencies(self, user=OVERALL):
+        """
+        The latency in seconds of every reply by a user, or by anyone for 'Overall'.
+        """
+        if user == OVERALL:
+            return self.latency
+        return self.latency[self.replier == self._code(user)]
+
+    def median_reply_minutes(self, user=OVERALL):
+        latencies = self.reply_latencies(user)
+        return float(np.median(latencies)) / 60 if len(latencies) else None
+
+    def reply_times(self):
+        """
+        Per user: replies sent, their median and mean latency in minutes, and sessions started
+        and taken part in, most replies first.
+        """
+        latency = pd.Series(self.latency / 60).groupby(self.replier)
+        table = pd.DataFrame({
+            'user': self.users,
+            'replies': np.bincount(self.replier, minlength=len(self.users)),
+            'median_reply_minutes': latency.median().reindex(range(len(self.users))).to_numpy(),
+            'mean_reply_minutes': latency.mean().reindex(range(len(self.users))).to_numpy(),
+            'sessions_started': self.sessions_started,
+            'sessions_joined': self.sessions_joined,
+        })
+        return table.sort_values('replies', ascending=False, kind='stable').reset_index(drop=True)
+
+    def reply_graph(self):
+        """
+        The number of replies from each user (rows) to each user (columns).
+        """
+        num_users = len(self.users)
+        counts = np.bincount(self.replier * num_users + self.replied_to, minlength=num_users * num_users)
+        index = pd.Index(self.users, name='replier')
+        return pd.DataFrame(counts.reshape(num_users, num_users), index=index,
+                            columns=pd.Index(self.users, name='replied_to'))
+
+    def reply_edges(self, user=OVERALL):
+        """
+        The reply graph as a list of (replier, replied_to, replies) edges, most replies first,
+        limited to the edges touching a user unless user is 'Overall'.
+        """
+        edges = self.reply_graph().stack().rename('replies').reset_index()
+        edges = edges[edges['replies'] > 0]
+        if user != OVERALL:
+            edges = edges[(edges['replier'] == user) | (edges['replied_to'] == user)]
+        return edges.sort_values('replies', ascending=False, kind='stable').reset_index(drop=True)
+
+    def user_sessions(self, user=OVERALL):
+        """
+        The sessions a user took part in, or every session for 'Overall'.
+        """
+        if user == OVERALL:
+            return self.sessions
+        sessions, codes = self.session_pairs
+        return self.sessions.iloc[sessions[codes == self._code(user)]]
+
+    def sessions_per_period(self, user=OVERALL, freq='M'):
+        """
+        Number of sessions a user took part in per period of a pandas frequency, by session start.
+        """
+        starts = self.user_sessions(user)['start']
+        return starts.groupby(starts.dt.to_period(freq)).size().rename('sessions')
+
+
+def build_conversations(df, gap_minutes=SESSION_GAP_MINUTES):
+    """
+    Segment a parsed chat into sessions and replies. Group notifications are left out, and the
+    messages are stably sorted by date first if the export was not in date order.
+    """
+    index = user_index(df)
+    users = [user for user in index.users if user != GROUP_NOTIFICATION]
+    keep = df['user'].to_numpy() != GROUP_NOTIFICATION
+    codes = index.codes[keep]
+    if GROUP_NOTIFICATION in index.code_of:
+        # close the gap the notification code leaves in the sorted user codes
+        codes = codes - (codes > index.code_of[GROUP_NOTIFICATION])
+    seconds = df['date'].to_numpy()[keep].astype('datetime64[s]').astype(np.int64)
+    if len(seconds) and (np.diff(seconds) < 0).any():
+        order = np.argsort(seconds, kind='stable')
+        codes, seconds = codes[order], seconds[order]
+    return Conversations(users, codes, seconds, gap_minutes)
+
@@ -0,0 +1,92 @@
+from collections import Counter
+import re
+import emoji
+import pandas as pd
+
+# Messages are scanned in batches joined by a separator that is not part of any emoji
+BATCH_SIZE = 10000
+SEPARATOR = '\n'
+
+# Runs of characters that may hold emojis: keycaps, or anything from the first emoji code point up
+# (which includes ZWJ, variation selectors, skin tones, regional indicators and tags). Only these
+# runs are walked through the trie, so plain text is skipped by the regex engine.
+CANDIDATE_PATTERN = re.compile('[#*0-9]\ufe0f?\u20e3|[\xa9\xae\u200d\u203c-\U0010ffff]+')
+
+_END = None
+
+
+def build_trie(sequences):
+    """
+    Build a character trie of emoji sequences for longest-match lookups.
+    """
+    trie = {}
+    for sequence in sequences:
+        node = trie
+        for char in sequence:
+            node = node.setdefault(char, {})
+        node[_END] = True
+    return trie
+
+
+EMOJI_TRIE = build_trie(emoji.EMOJI_DATA)
+
+
+def find_emojis(text, trie=EMOJI_TRIE):
+    """
+    Return the emojis of a text, matching the longest sequence at each position so ZWJ
+    sequences, skin tones and flags count as one emoji.
+    """
+    found = []
+    for run in CANDIDATE_PATTERN.findall(text):
+        start = 0
+        length = len(run)
+        while start < length:
+            node = trie
+            end = 0
+            i = start
+            while i < length:
+                node = node.get(run[i])
+                if node is None:
+                    break
+                i += 1
+                if _END in node:
+                    end = i
+            if end:
+                found.append(run[start:end])
+                start = end
+            else:
+                start += 1
+    return found
+
+
+def count_emojis(messages, batch_size=BATCH_SIZE):
+    """
+    Count the emojis in an iterable of messages.
+    """
+    counts = Counter()
+    batch = []
+    for message in messages:
+        batch.append(message)
+        if len(batch) == batch_size:
+            counts.update(find_emojis(SEPARATOR.join(batch)))
+            batch = []
+    if batch:
+        counts.update(find_emojis(SEPARATOR.join(batch)))
+    return counts
+
+
+def count_emojis_by_user(df, batch_size=BATCH_SIZE):
+    """
+    Count the emojis of every user in one pass, returning ({user: Counter}, overall Counter).
+    """
+    by_user = {}
+    overall = Counter()
+    for user, messages in df.groupby('user', sort=False)['message']:
+        counts = count_emojis(messages, batch_size)
+        by_user[user] = counts
+        overall.update(counts)
+    return by_user, overall
+
+
+def emoji_frame(counts):
+    return pd.DataFrame(counts.most_common(), columns=['Emoji', 'Count'])
@@ -1,19 +1,25 @@
 from collections import Counter
-from urlextract import URLExtract
+import string
 from wordcloud import wordcloud
 import pandas as pd
-import emoji
+from activity_cube import activity_cube
+from instrumentation import instrument
+import emojis
+import lexicons
+import links
+import sentiment
 import streamlit as st
-from collections import defaultdict
-import re
+from user_index import user_frame
 
-extract = URLExtract()
+
+def read_stop_words():
+    return lexicons.stop_words()
 
 
 @st.cache_data
+@instrument()
 def fetch_stats(selected_user, df):
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
+    df = user_frame(df, selected_user)
 
     # fetch number of messages
     num_messages = df.shape[0]
@@ -27,14 +33,13 @@ def fetch_stats(selected_user, df):
     num_media = df[df['message'] == '<Media omitted>\n'].shape[0]
 
     # fetch number of links
-    links = []
-    for message in df['message']:
-        links.extend(extract.find_urls(message))
+    num_links = int(links.link_counts(df['message']).sum())
 
-    return num_messages, len(words), num_media, len(links)
+    return num_messages, len(words), num_media, num_links
 
 
 @st.cache_data
+@instrument()
 def most_busy_users(df):
     df = df[df['user'] != 'group notification']
     x = df['user'].value_counts().head()
@@ -43,35 +48,56 @@ def most_busy_users(df):
     return x, df
 
 
+# Words laid out in a wordcloud; the rest would be too small to read anyway
+WORDCLOUD_WORDS = 200
+
+
+def wordcloud_frequencies(words, top=WORDCLOUD_WORDS):
+    """
+    The top words of a word counter for a wordcloud: punctuation is stripped from the ends of
+    each word, and links, words without a letter and the wordcloud's English stop words are left out.
+    """
+    frequencies = Counter()
+    for word, count in words.items():
+        if links.URL_HINT.search(word):
+            continue
+        word = word.strip(string.punctuation)
+        if word not in wordcloud.STOPWORDS and any(character.isalpha() for character in word):
+            frequencies[word] += count
+    return dict(frequencies.most_common(top))
+
+
+def render_wordcloud(words, width=500, height=500, top=WORDCLOUD_WORDS):
+    """
+    Lay out a wordcloud from a word counter without tokenizing any text again. Returns None
+    when there is no word to show.
+    """
+    frequencies = wordcloud_frequencies(words, top)
+    if not frequencies:
+        return None
+    wc = wordcloud.WordCloud(width=width, height=height, min_font_size=10, background_color='white')
+    return wc.generate_from_frequencies(frequencies)
+
+
 @st.cache_data
+@instrument()
 def create_wordcloud(selected_user, df):
-    f = open('stop_hinglish.txt', 'r', encoding='utf-8')
-    stop_words = f.read()
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
+    stop_words = read_stop_words()
+    df = user_frame(df, selected_user)
 
     temp = df[df['user'] != 'group notification']
     temp = temp[temp['message'] != '<Media omitted>\n']
 
-    def remove_stop_words(message):
-        y = []
-        for word in message.lower().split():
-            if word not in stop_words:
-                y.append(word)
-        return " ".join(y)
-
-    wc = wordcloud.WordCloud(width=500, height=500, min_font_size=10, background_color='white')
-    temp['message'].apply(remove_stop_words)
-    df_wc = wc.generate(temp['message'].str.cat(sep=" "))
-    return df_wc
+    words = Counter(word for message in temp['message'] for word in message.lower().split()
+                    if word not in stop_words)
+    return render_wordcloud(words)
 
 
 @st.cache_data
+@instrument()
 def most_common_words(selected_user, df):
-    f = open('stop_hinglish.txt', 'r', encoding='utf-8')
-    stop_words = f.read()
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
+    stop_words = read_stop_words()
+    df = user_frame(df, selected_user)
 
     temp = df[df['user'] != 'group notification']
     temp = temp[temp['message'] != '<Media omitted>\n']
@@ -88,102 +114,56 @@ def most_common_words(selected_user, df):
 
 
 @st.cache_data
+@instrument()
 def get_emojis(selected_user, df):
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
-
-    emojis = []
-    for message in df['message']:
-        emojis.extend([c for c in message if c in emoji.EMOJI_DATA.keys()])
+    df = user_frame(df, selected_user)
 
-    emoji_df = pd.DataFrame(Counter(emojis).most_common(), columns=['Emoji', 'Count'])
-    return emoji_df
+    return emojis.emoji_frame(emojis.count_emojis(df['message']))
 
 
 @st.cache_data
+@instrument()
 def monthly_timeline(selected_user, df):
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
-
-    timeline = df.groupby(['year', 'month_num', 'month']).count()['message'].reset_index()
-    time = []
-    for i in range(timeline.shape[0]):
-        time.append(timeline['month'][i] + "-" + str(timeline['year'][i]))
-
-    timeline['time'] = time
-    return timeline
+    return activity_cube(df).monthly_timeline(selected_user)
 
 
 @st.cache_data
+@instrument()
 def get_daily_timeline(selected_user, df):
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
-
-    daily_timeline = df.groupby('only_date').count()['message'].reset_index()
-    return daily_timeline
+    return activity_cube(df).daily_timeline(selected_user)
 
 
 @st.cache_data
+@instrument()
 def week_activity_map(selected_user, df):
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
-    return df['day_name'].value_counts()
+    return activity_cube(df).busy_day(selected_user).sort_values(ascending=False, kind='stable')
 
 
 @st.cache_data
+@instrument()
 def month_activity_map(selected_user, df):
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
-    return df['month'].value_counts()
+    return activity_cube(df).busy_month(selected_user).sort_values(ascending=False, kind='stable')
 
 
+@instrument()
 def activity_heat_map(selected_user, df):
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
-    user_heatmap = df.pivot_table(index='day_name', columns='time_period', values='message', aggfunc='count').fillna(0)
-    return user_heatmap
+    return activity_cube(df).heatmap(selected_user)
 
 
 def remove_emojis(text):
-    # Pattern to remove emojis
-    emoji_pattern = re.compile("["
-                               u"\U0001F600-\U0001F64F"  # emoticons
-                               u"\U0001F300-\U0001F5FF"  # symbols & pictographs
-                               u"\U0001F680-\U0001F6FF"  # transport & map symbols
-                               u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
-                               u"\U00002500-\U00002BEF"  # chinese char
-                               u"\U00002702-\U000027B0"
-                               u"\U00002702-\U000027B0"
-                               u"\U000024C2-\U0001F251"
-                               u"\U0001f926-\U0001f937"
-                               u"\U00010000-\U0010ffff"
-                               u"\u2640-\u2642"
-                               u"\u2600-\u2B55"
-                               u"\u200d"
-                               u"\u23cf"
-                               u"\u23e9"
-                               u"\u231a"
-                               u"\ufe0f"  # dingbats
-                               u"\u3030"
-                               "]+", flags=re.UNICODE)
-    return emoji_pattern.sub(r'', text)
+    return sentiment.EMOJI_PATTERN.sub(r'', text)
 
 
 # Read positive and negative words files
 def read_sentiment_words(positive_words_file, negative_words_file):
-    with open(positive_words_file, 'r', encoding='utf-8') as file:
-        positive_words = file.read().splitlines()
-
-    with open(negative_words_file, 'r', encoding='utf-8') as file:
-        negative_words = file.read().splitlines()
-
-    return positive_words, negative_words
+    return lexicons.load_words(positive_words_file), lexicons.load_words(negative_words_file)
 
 
 # Assign sentiment label to messages
 def assign_sentiment_label(message, positive_words, negative_words):
-    positive_count = sum(1 for word in message.split() if word in positive_words)
-    negative_count = sum(1 for word in message.split() if word in negative_words)
+    words = message.split()
+    positive_count = sum(1 for word in words if word in positive_words)
+    negative_count = sum(1 for word in words if word in negative_words)
 
     if positive_count > negative_count:
         return 'positive'
@@ -195,38 +175,16 @@ def assign_sentiment_label(message, positive_words, negative_words):
 
 # Generate training data for sentiment analysis
 def read_hinglish_stop_words(stop_words_file):
-    with open(stop_words_file, 'r', encoding='utf-8') as file:
-        stop_words = file.read().splitlines()
-    return stop_words
+    return lexicons.load_words(stop_words_file)
 
 
 # Generate training data for sentiment analysis
-def generate_training_data(df, positive_words_file, negative_words_file, hinglish_stop_words_file):
-    positive_words, negative_words = read_sentiment_words(positive_words_file, negative_words_file)
-    hinglish_stop_words = read_hinglish_stop_words(hinglish_stop_words_file)
-
-    df = df[df['message'] != '<Media omitted>\n']
-    training_data = defaultdict(list)
-
-    for message in df['message']:
-        # Remove emojis
-        message = remove_emojis(message)
-        # Remove links
-        message = remove_links(message)
-        # Remove numbers
-        message = remove_numbers(message)
-
-        # Remove Hinglish stop words
-        message = remove_hinglish_stop_words(message, hinglish_stop_words)
-
-        sentiment_label = assign_sentiment_label(message, positive_words, negative_words)
-        training_data['message'].append(message)
-        training_data['sentiment'].append(sentiment_label)
-
-    training_df = pd.DataFrame(training_data)
-    # remove empty messages and then only return the dataframe
-    # training_df = training_df[training_df['message'] != '']
-    return training_df
+@instrument()
+def generate_training_data(df, positive_words_file, negative_words_file, hinglish_stop_words_file, processes=1):
+    df = sentiment.text_messages(df)
+    # Remove emojis, links, numbers and Hinglish stop words, then label, for all messages at once
+    return sentiment.label_messages(df['message'], positive_words_file, negative_words_file,
+                                    hinglish_stop_words_file, processes)
 
 
 # Function to remove Hinglish stop words
@@ -237,8 +195,8 @@ def remove_hinglish_stop_words(text, stop_words):
 
 
 def remove_links(text):
-    return re.sub(r'http\S+', '', text)
+    return links.remove_links(text)
 
 
 def remove_numbers(text):
-    return re.sub(r'\d+', '', text)
+    return sentiment.NUMBER_PATTERN.sub('', text)
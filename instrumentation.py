@@ -0,0 +1,170 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import functools
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+# Append every recorded stage to this JSON lines file, if set
+PERF_LOG_FILE = os.environ.get('PERF_LOG_FILE')
+
+_recorder = ContextVar('recorder', default=None)
+
+
+def rss():
+    """
+    Current resident set size in bytes; the peak so far where /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class PeakMemory:
+    """
+    Track the highest resident set size while the block runs, sampling it from a thread.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.start = self.peak = 0
+        self._done = threading.Event()
+
+    def _sample(self):
+        while not self._done.wait(self.interval):
+            self.peak = max(self.peak, rss())
+
+    def __enter__(self):
+        self.start = self.peak = rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._done.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss())
+
+    @property
+    def delta(self):
+        return self.peak - self.start
+
+
+@contextmanager
+def measure(name, rows=None):
+    """
+    Measure a block, yielding its record: {stage, rows, wall_s, cpu_s, peak_rss_delta_mb}. The
+    block may set record['rows'].
+    """
+    record = {'stage': name, 'rows': rows}
+    with PeakMemory() as memory:
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall_s'] = round(time.perf_counter() - wall, 6)
+            record['cpu_s'] = round(time.process_time() - cpu, 6)
+    record['peak_rss_delta_mb'] = round(memory.delta / 1024 ** 2, 3)
+
+
+class Recorder:
+    """
+    The stages measured while recording, in the order they finished, with their nesting depth.
+    """
+
+    def __init__(self, log_file=None):
+        self.log_file = log_file
+        self.records = []
+        self.depth = 0
+
+    def add(self, record):
+        self.records.append(record)
+        if self.log_file:
+            with open(self.log_file, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(dict(record, time=time.time())) + '\n')
+
+    def json_lines(self):
+        return ''.join(json.dumps(record) + '\n' for record in self.records)
+
+
+@contextmanager
+def recording(log_file=PERF_LOG_FILE):
+    """
+    Record every stage run in this thread until the block ends, yielding the Recorder.
+    """
+    recorder = Recorder(log_file)
+    token = _recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _recorder.reset(token)
+
+
+class _Disabled:
+    # what stage yields when nothing is recording: a throwaway record, no measurement
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_DISABLED = _Disabled()
+
+
+@contextmanager
+def _recorded_stage(recorder, name, rows):
+    recorder.depth += 1
+    try:
+        with measure(name, rows) as record:
+            record['depth'] = recorder.depth - 1
+            yield record
+    finally:
+        recorder.depth -= 1
+        recorder.add(record)
+
+
+def stage(name, rows=None):
+    """
+    Context manager measuring a block as a stage when recording; otherwise it does nothing.
+    The block may set rows through the yielded record: with stage('parse') as record: ...
+    """
+    recorder = _recorder.get()
+    if recorder is None:
+        return _DISABLED
+    return _recorded_stage(recorder, name, rows)
+
+
+def _count_rows(result):
+    if hasattr(result, 'shape'):
+        return int(result.shape[0]) if result.shape else None
+    return len(result) if isinstance(result, (list, dict)) else None
+
+
+def instrument(name=None):
+    """
+    Decorator recording each call of a function as a stage (named after the function), with
+    the length of its result as rows. Without a recording the function is called directly.
+    """
+    def decorator(function):
+        stage_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            recorder = _recorder.get()
+            if recorder is None:
+                return function(*args, **kwargs)
+            with _recorded_stage(recorder, stage_name, None) as record:
+                result = function(*args, **kwargs)
+                record['rows'] = _count_rows(result)
+            return result
+
+        return wrapper
+
+    return decorator
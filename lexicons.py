@@ -0,0 +1,40 @@
+import os
+import threading
+
+LEXICON_DIR = os.path.dirname(os.path.abspath(__file__))
+STOP_WORDS_FILE = os.path.join(LEXICON_DIR, 'stop_hinglish.txt')
+POSITIVE_WORDS_FILE = os.path.join(LEXICON_DIR, 'positive-words.txt')
+NEGATIVE_WORDS_FILE = os.path.join(LEXICON_DIR, 'negative-words.txt')
+
+# path -> (mtime, frozenset of lines), shared by every caller in the process
+_lexicons = {}
+_lock = threading.Lock()
+
+
+def load_words(path):
+    """
+    Return the lines of a word list as a frozenset, reading the file again only when its
+    modification time changes.
+    """
+    path = os.path.abspath(path)
+    mtime = os.stat(path).st_mtime_ns
+    cached = _lexicons.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with _lock:
+        with open(path, 'r', encoding='utf-8') as file:
+            words = frozenset(file.read().splitlines())
+        _lexicons[path] = (mtime, words)
+    return words
+
+
+def stop_words():
+    return load_words(STOP_WORDS_FILE)
+
+
+def positive_words():
+    return load_words(POSITIVE_WORDS_FILE)
+
+
+def negative_words():
+    return load_words(NEGATIVE_WORDS_FILE)
@@ -0,0 +1,47 @@
+from functools import lru_cache
+import re
+import pandas as pd
+
+# Cheap test for anything URLExtract could report: a scheme, or a dot between word characters
+# (www.x, domain.tld, ...). Messages without it never reach the extractor.
+URL_HINT = re.compile(r'://|\w\.\w')
+LINK_PATTERN = re.compile(r'http\S+')
+
+_extractor = None
+
+
+def get_extractor():
+    """
+    Build the URLExtract instance on first use, since loading its TLD list is slow.
+    """
+    global _extractor
+    if _extractor is None:
+        from urlextract import URLExtract
+        _extractor = URLExtract()
+    return _extractor
+
+
+@lru_cache(maxsize=65536)
+def find_links(message):
+    """
+    URLs in a message, memoized per message text.
+    """
+    if not URL_HINT.search(message):
+        return ()
+    return tuple(get_extractor().find_urls(message))
+
+
+def link_counts(messages):
+    """
+    Number of URLs in each message of a Series, running the extractor only on candidates.
+    """
+    counts = pd.Series(0, index=messages.index)
+    candidates = messages.str.contains(URL_HINT)
+    counts[candidates] = [len(find_links(message)) for message in messages[candidates]]
+    return counts
+
+
+def remove_links(text):
+    if 'http' not in text:
+        return text
+    return LINK_PATTERN.sub('', text)
@@ -0,0 +1,324 @@
+import hashlib
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import tempfile
+import time
+import joblib
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+import sklearn
+from sklearn.base import clone
+import chat_cache
+
+MODEL_DIR = os.environ.get('MODEL_CACHE_DIR', os.path.join(chat_cache.CACHE_DIR, 'models'))
+MAX_MODEL_BYTES = int(os.environ.get('MODEL_CACHE_MAX_BYTES', 1024 ** 3))
+
+# Rows whose hash is divisible by TEST_MODULUS form the test split (~20%). The split depends only
+# on the row itself, so appending rows never moves earlier rows between train and test.
+TEST_MODULUS = 5
+
+# A cached vectorizer is reused for appended rows only while they are at most this fraction of
+# the data, since its vocabulary does not grow; beyond that everything is fitted again.
+MAX_APPENDED_FRACTION = 0.25
+
+
+def _digest(*parts):
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def params_key(estimator):
+    """
+    Fingerprint of an estimator's class, hyperparameters and the scikit-learn version.
+    """
+    params = sorted((name, repr(value)) for name, value in estimator.get_params().items())
+    return _digest(type(estimator).__name__, params, sklearn.__version__)
+
+
+def row_hashes(messages, labels):
+    """
+    One 64-bit hash per (message, label) row.
+    """
+    rows = pd.DataFrame({'message': np.asarray(messages, dtype=object), 'sentiment': np.asarray(labels, dtype=object)})
+    return pd.util.hash_pandas_object(rows, index=False).to_numpy()
+
+
+class TrainingRun:
+    """
+    The featurized training data of one set of labelled messages, with fitted vectorizer and
+    models stored on disk under fingerprints of the data and hyperparameters. When the data only
+    appends rows to a previously trained set, the cached vectorizer is reused and models are
+    updated incrementally (partial_fit) or warm-started where the estimator allows it.
+    """
+
+    def __init__(self, messages, labels, vectorizer, directory=MODEL_DIR, max_bytes=MAX_MODEL_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.labels = np.asarray(labels, dtype=object)
+        self.hashes = row_hashes(messages, labels)
+        self.data_key = _digest(self.hashes.tobytes())
+        self.test_mask = self.hashes % TEST_MODULUS == 0
+        self.base_rows = 0
+        self.base_data_key = None
+
+        vectorizer_params = params_key(vectorizer)
+        latest_path = self._path('latest', vectorizer_params, suffix='json')
+        artifact = self._load('vectorizer', vectorizer_params, self.data_key)
+        if artifact is None:
+            artifact = self._appendable_vectorizer(vectorizer_params, latest_path)
+        if artifact is None:
+            vectorizer = clone(vectorizer)
+            vectorizer.fit(messages)
+            artifact = {'vectorizer': vectorizer, 'key': _digest(vectorizer_params, self.data_key)}
+            self._save(artifact, 'vectorizer', vectorizer_params, self.data_key)
+        self.vectorizer = artifact['vectorizer']
+        self.vectorizer_key = artifact['key']
+        self.X_vec = self.vectorizer.transform(messages)
+        self._save_json({'data_key': self.data_key, 'rows': len(self.hashes)}, latest_path)
+
+        train = ~self.test_mask
+        self.X_train, self.y_train = self.X_vec[train], self.labels[train]
+        self.X_test, self.y_test = self.X_vec[self.test_mask], self.labels[self.test_mask]
+
+    def _appendable_vectorizer(self, vectorizer_params, latest_path):
+        # the vectorizer of the last trained data, if this data only appends rows to it
+        latest = self._load_json(latest_path)
+        if latest is None or latest['rows'] >= len(self.hashes):
+            return None
+        if len(self.hashes) - latest['rows'] > MAX_APPENDED_FRACTION * len(self.hashes):
+            return None
+        if _digest(self.hashes[:latest['rows']].tobytes()) != latest['data_key']:
+            return None
+        artifact = self._load('vectorizer', vectorizer_params, latest['data_key'])
+        if artifact is not None:
+            self.base_rows = latest['rows']
+            self.base_data_key = latest['data_key']
+            self._save(artifact, 'vectorizer', vectorizer_params, self.data_key)
+        return artifact
+
+    def cached(self, model):
+        """
+        The fitted model cached for this data, or None.
+        """
+        return self._load('model', params_key(model), self.vectorizer_key, self.data_key)
+
+    def update_plan(self, model):
+        """
+        Return (previous model, kind, rows) when the model cached for the data this run appends to
+        can be updated rather than fitted again: kind is 'partial_fit' on the appended training
+        rows (their positions in X_train) or 'warm_start' on all of them. Else None.
+        """
+        if self.base_data_key is None:
+            return None
+        previous = self._load('model', params_key(model), self.vectorizer_key, self.base_data_key)
+        if previous is None:
+            return None
+        if hasattr(previous, 'partial_fit'):
+            kind = 'partial_fit'
+        elif hasattr(previous, 'coef_') and 'warm_start' in previous.get_params():
+            kind = 'warm_start'
+        else:
+            return None
+        rows = np.flatnonzero(np.flatnonzero(~self.test_mask) >= self.base_rows)
+        return previous, kind, rows
+
+    def reuse(self, model):
+        """
+        Return (fitted model, how) for a model that is cached for this data ('loaded') or can be
+        updated from the one cached for the data this run appends to ('updated'), else None.
+        The update runs in this thread; fit_models runs it in a worker.
+        """
+        fitted = self.cached(model)
+        if fitted is not None:
+            return fitted, 'loaded'
+        plan = self.update_plan(model)
+        if plan is None:
+            return None
+        try:
+            updated = _update(*plan, self.X_train, self.y_train)
+        except ValueError:
+            # e.g. a label the model has not seen before
+            return None
+        self.store(model, updated)
+        return updated, 'updated'
+
+    def store(self, model, fitted):
+        """
+        Save a fitted copy of model for this run.
+        """
+        self._save(fitted, 'model', params_key(model), self.vectorizer_key, self.data_key)
+
+    def fit(self, model):
+        """
+        Return (fitted model, how), how being 'loaded', 'updated' or 'trained'.
+        """
+        reused = self.reuse(model)
+        if reused is not None:
+            return reused
+        fitted = clone(model).fit(self.X_train, self.y_train)
+        self.store(model, fitted)
+        return fitted, 'trained'
+
+    def _path(self, kind, *keys, suffix='joblib'):
+        return os.path.join(self.directory, '%s-%s.%s' % (kind, '-'.join(keys), suffix))
+
+    def _load(self, kind, *keys):
+        path = self._path(kind, *keys)
+        try:
+            value = joblib.load(path)
+        except (OSError, EOFError, ValueError):
+            return None
+        os.utime(path)
+        return value
+
+    def _save(self, value, kind, *keys):
+        path = self._path(kind, *keys)
+        chat_cache.write_atomic(path, lambda tmp_path: joblib.dump(value, tmp_path), self.max_bytes,
+                                versioned=False)
+
+    def _load_json(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _save_json(self, value, path):
+        chat_cache.write_atomic(path, lambda tmp_path: chat_cache.dump_json(value, tmp_path), self.max_bytes,
+                                versioned=False)
+
+
+def _dump_csr(directory, name, matrix):
+    matrix = matrix.tocsr().astype(np.float64)
+    for part in ('data', 'indices', 'indptr'):
+        np.save(os.path.join(directory, '%s.%s.npy' % (name, part)), getattr(matrix, part))
+    return matrix.shape
+
+
+def _load_csr(directory, name, shape):
+    # memory-mapped, read-only buffers shared through the page cache by every worker
+    parts = [np.load(os.path.join(directory, '%s.%s.npy' % (name, part)), mmap_mode='r')
+             for part in ('data', 'indices', 'indptr')]
+    return csr_matrix(tuple(parts), shape=shape, copy=False)
+
+
+def _update(previous, kind, rows, X_train, y_train):
+    # see TrainingRun.update_plan; raises ValueError when partial_fit cannot take the rows
+    if kind == 'partial_fit':
+        if len(rows):
+            previous.partial_fit(X_train[rows], y_train[rows])
+    else:
+        warm_start = previous.get_params()['warm_start']
+        previous.set_params(warm_start=True)
+        previous.fit(X_train, y_train)
+        previous.set_params(warm_start=warm_start)
+    return previous
+
+
+def _train_worker(model, plan, directory, shapes, connection):
+    try:
+        X_train = _load_csr(directory, 'train', shapes['train'])
+        X_test = _load_csr(directory, 'test', shapes['test'])
+        y_train = np.load(os.path.join(directory, 'y_train.npy'), mmap_mode='r')
+        fitted, how = None, 'trained'
+        if plan is not None:
+            try:
+                fitted, how = _update(*plan, X_train, y_train), 'updated'
+            except ValueError:
+                # e.g. a label the model has not seen before: fit from scratch instead
+                fitted, how = None, 'trained'
+        if fitted is None:
+            fitted = clone(model).fit(X_train, y_train)
+        connection.send((fitted, fitted.predict(X_test), how, None))
+    except Exception as error:
+        connection.send((None, None, None, repr(error)))
+    finally:
+        connection.close()
+
+
+def _receive(connection, process):
+    # (fitted, predictions, how, error) from a worker's pipe; EOF means it died without sending
+    try:
+        result = connection.recv()
+    except (EOFError, OSError):
+        result = None
+    connection.close()
+    process.join()
+    return result or (None, None, None, 'exit code %s' % process.exitcode)
+
+
+def fit_models(run, models, workers=None, time_budget=None, poll_interval=0.2):
+    """
+    Fit models concurrently, one process each and at most workers at a time, yielding
+    (name, fitted model, how, test predictions) as each one finishes. Models cached for this data
+    come first ('loaded', without predictions); the others are fitted ('trained') or updated from
+    the model of the data this run appends to ('updated') in the workers. The training matrix is shared with the workers as memory-mapped CSR buffers rather than
+    pickled. time_budget (seconds, or {name: seconds}) stops models that run longer; those are
+    yielded with how 'timed out' and no model, like failures ('failed: <error>').
+    """
+    pending = []
+    for name, model in models.items():
+        fitted = run.cached(model)
+        if fitted is None:
+            pending.append((name, model))
+        else:
+            yield name, fitted, 'loaded', None
+    if not pending:
+        return
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    budgets = time_budget if isinstance(time_budget, dict) else {name: time_budget for name, _ in pending}
+    with tempfile.TemporaryDirectory() as directory:
+        shapes = {'train': _dump_csr(directory, 'train', run.X_train), 'test': _dump_csr(directory, 'test', run.X_test)}
+        np.save(os.path.join(directory, 'y_train.npy'), run.y_train.astype(str))
+
+        # one pipe per worker: terminating a worker in the middle of sending its model can only
+        # break its own pipe, which is discarded with it
+        running = {}
+        try:
+            while pending or running:
+                while pending and len(running) < workers:
+                    name, model = pending.pop(0)
+                    receiver, sender = multiprocessing.Pipe(duplex=False)
+                    process = multiprocessing.Process(target=_train_worker, daemon=True,
+                                                      args=(model, run.update_plan(model), directory, shapes, sender))
+                    process.start()
+                    sender.close()
+                    running[receiver] = (name, model, process, time.monotonic())
+
+                ready = multiprocessing.connection.wait(list(running), timeout=poll_interval)
+                now = time.monotonic()
+                for receiver, (name, model, process, started) in list(running.items()):
+                    # a result that arrived is read before the budget is checked, so a model that
+                    # finished in time is never reported as timed out
+                    if receiver in ready or receiver.poll():
+                        del running[receiver]
+                        fitted, y_pred, how, error = _receive(receiver, process)
+                        if error is not None:
+                            yield name, None, 'failed: ' + error, None
+                        else:
+                            run.store(model, fitted)
+                            yield name, fitted, how, y_pred
+                        continue
+                    budget = budgets.get(name)
+                    if budget is not None and now - started > budget:
+                        del running[receiver]
+                        process.terminate()
+                        process.join()
+                        process.close()
+                        receiver.close()
+                        yield name, None, 'timed out', None
+        finally:
+            # also reached when the caller stops iterating early, e.g. a Streamlit rerun that drops
+            # the generator: workers still fitting must not outlive it
+            for receiver, (_, _, process, _) in running.items():
+                process.terminate()
+                process.join()
+                process.close()
+                receiver.close()
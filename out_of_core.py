@@ -0,0 +1,88 @@
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+from sklearn.naive_bayes import MultinomialNB
+import model_registry
+import sentiment
+
+# Fixed feature dimension: memory no longer grows with the vocabulary of the corpus
+N_FEATURES = 2 ** 18
+CHUNK_SIZE = 20000
+
+
+def hashing_vectorizer(n_features=N_FEATURES):
+    """
+    Stateless featurizer producing non-negative, l2-normalized token weights, usable by MultinomialNB.
+    """
+    return HashingVectorizer(n_features=n_features, alternate_sign=False)
+
+
+def streaming_models():
+    """
+    Classifiers that can learn chunk by chunk with partial_fit.
+    """
+    return {
+        'Multinomial Naive Bayes': MultinomialNB(),
+        'Linear SVM (SGD)': SGDClassifier(random_state=42),
+    }
+
+
+def iter_chunks(messages, labels, chunk_size=CHUNK_SIZE):
+    """
+    Yield (messages, labels) chunks of in-memory training data.
+    """
+    for start in range(0, len(messages), chunk_size):
+        yield messages[start:start + chunk_size], labels[start:start + chunk_size]
+
+
+def _split(messages, labels):
+    # the same row-hash test split as model_registry.TrainingRun
+    messages = np.asarray(messages, dtype=object)
+    labels = np.asarray(labels, dtype=object)
+    test = model_registry.row_hashes(messages, labels) % model_registry.TEST_MODULUS == 0
+    return messages, labels, test
+
+
+def train_streaming(make_chunks, models, vectorizer=None, classes=sentiment.SENTIMENTS):
+    """
+    Train models with partial_fit on hashed features, one chunk at a time, so memory is bounded by
+    the chunk size. make_chunks() must return a fresh iterable of (messages, labels) chunks: the
+    first pass trains on the train rows, the second predicts the held-out test rows, e.g.
+    lambda: training_store.iter_chunks() for the stored training data. Returns (models, y_test, {name: test predictions}).
+    """
+    if vectorizer is None:
+        vectorizer = hashing_vectorizer()
+    for messages, labels in make_chunks():
+        messages, labels, test = _split(messages, labels)
+        if test.all():
+            continue
+        X_train = vectorizer.transform(messages[~test])
+        for model in models.values():
+            model.partial_fit(X_train, labels[~test], classes=classes)
+
+    y_test = []
+    predictions = {name: [] for name in models}
+    for messages, labels in make_chunks():
+        messages, labels, test = _split(messages, labels)
+        if not test.any():
+            continue
+        X_test = vectorizer.transform(messages[test])
+        y_test.append(labels[test])
+        for name, model in models.items():
+            predictions[name].append(model.predict(X_test))
+
+    y_test = np.concatenate(y_test) if y_test else np.array([], dtype=object)
+    predictions = {name: np.concatenate(predicted) if predicted else np.array([], dtype=object)
+                   for name, predicted in predictions.items()}
+    return models, y_test, predictions
+
+
+def predict_chunks(model, messages, vectorizer=None, chunk_size=CHUNK_SIZE):
+    """
+    Predict a long sequence of messages chunk by chunk.
+    """
+    if vectorizer is None:
+        vectorizer = hashing_vectorizer()
+    predicted = [model.predict(vectorizer.transform(messages[start:start + chunk_size]))
+                 for start in range(0, len(messages), chunk_size)]
+    return np.concatenate(predicted) if predicted else np.array([], dtype=object)
@@ -0,0 +1,122 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import re
+import threading
+import pandas as pd
+from textblob import TextBlob
+from textblob._text import EMOTICONS
+from textblob.en import sentiment as pattern_sentiment
+
+# Unique messages per process pool task, and messages whose label is remembered across calls
+CHUNK_SIZE = 20000
+CACHE_SIZE = 200000
+
+WORD_PATTERN = re.compile(r'[^\W\d_]+')
+
+# Characters every emoticon (and the sarcasm mark '(!)') contains at least one of
+EMOTICON_CHARS = frozenset(char for emoticons in EMOTICONS.values() for emoticon in emoticons
+                           for char in emoticon if not char.isalnum())
+
+_trigger_words = None
+
+
+def trigger_words():
+    """
+    Every letter run that may belong to a word of the TextBlob lexicon. A message with none of
+    them and no emoticon character gets no assessment, so its polarity is 0.0.
+    """
+    global _trigger_words
+    if _trigger_words is None:
+        words = set()
+        # tokens never hold spaces, so multi-word entries can not match
+        for word in pattern_sentiment.keys():
+            if ' ' not in word:
+                words.update(WORD_PATTERN.findall(word))
+        _trigger_words = frozenset(words)
+    return _trigger_words
+
+
+def may_have_polarity(message):
+    if not EMOTICON_CHARS.isdisjoint(message):
+        return True
+    words = trigger_words()
+    for word in WORD_PATTERN.findall(message.lower()):
+        # the tokenizer splits "don't" into "do n't", cutting the n off the letter run
+        if word in words or (word.endswith('n') and word[:-1] in words):
+            return True
+    return False
+
+
+def polarity_label(message):
+    """
+    Label a message positive, negative or neutral by the sign of its TextBlob polarity.
+    """
+    if not may_have_polarity(message):
+        return 'neutral'
+    polarity = TextBlob(message).sentiment.polarity
+    if polarity > 0:
+        return 'positive'
+    elif polarity < 0:
+        return 'negative'
+    return 'neutral'
+
+
+def _label_chunk(messages):
+    return [polarity_label(message) for message in messages]
+
+
+class LabelCache:
+    """
+    Bounded least recently used mapping of message text to label, shared by every call.
+    """
+
+    def __init__(self, max_size=CACHE_SIZE):
+        self.max_size = max_size
+        self.labels = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, message):
+        with self.lock:
+            label = self.labels.get(message)
+            if label is not None:
+                self.labels.move_to_end(message)
+            return label
+
+    def put(self, message, label):
+        with self.lock:
+            self.labels[message] = label
+            self.labels.move_to_end(message)
+            while len(self.labels) > self.max_size:
+                self.labels.popitem(last=False)
+
+
+LABELS = LabelCache()
+
+
+def label_messages(messages, processes=1, chunk_size=CHUNK_SIZE, cache=LABELS):
+    """
+    Label a sequence of messages with polarity_label. Each distinct message is scored once,
+    labels already in the cache are reused, and with processes > 1 the remaining messages are
+    scored in chunks in a process pool.
+    """
+    unique = pd.unique(pd.Series(messages, dtype=object)).tolist()
+    labels = {}
+    missing = []
+    for message in unique:
+        label = cache.get(message)
+        if label is None:
+            missing.append(message)
+        else:
+            labels[message] = label
+
+    if processes <= 1 or len(missing) <= chunk_size:
+        scored = _label_chunk(missing)
+    else:
+        chunks = [missing[start:start + chunk_size] for start in range(0, len(missing), chunk_size)]
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            scored = [label for chunk in pool.map(_label_chunk, chunks) for label in chunk]
+
+    for message, label in zip(missing, scored):
+        cache.put(message, label)
+        labels[message] = label
+    return [labels[message] for message in messages]
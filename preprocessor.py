@@ -1,72 +1,147 @@
+import io
 import re
 import pandas as pd
+from instrumentation import instrument
 
+# Bump whenever the parsed DataFrame changes, so frames cached by chat_cache are invalidated
+SCHEMA_VERSION = 2
 
-def preprocess(data):
-    # Define patterns for both formats
-    pattern1 = r'\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}\s-\s'  # Format: 12/10/2023, 18:47 -
-    pattern2 = r'\[\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}:\d{2}\s[AP]M\]\s'  # Format: [20/01/24, 5:08:18 PM]
+# Message header formats, each compiled once: the header regex captures the timestamp and the
+# (optional) "user: " prefix in one match, paired with the strptime format of the captured date.
+# A header may follow a byte order mark (first line of the file) or the left-to-right marks iOS
+# puts before attachment and system lines; they are consumed with the header.
+HEADER_PREFIX = '[\ufeff\u200e]*'
+HEADER_FORMATS = (
+    # Format: 12/10/2023, 18:47 -
+    (re.compile(HEADER_PREFIX + r'(?P<date>\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2})\s-\s(?:(?P<user>.+?):\s)?'),
+     r'%d/%m/%Y, %H:%M'),
+    # Format: [20/01/24, 5:08:18 PM]
+    (re.compile(HEADER_PREFIX +
+                r'\[(?P<date>\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}:\d{2}\s[AP]M)\]\s(?:(?P<user>.+?):\s)?'),
+     r'%d/%m/%y, %I:%M:%S %p'),
+)
 
-    # Try pattern1 first
-    messages = re.split(pattern1, data)[1:]
-    dates = re.findall(pattern1, data)
+# Labels of the low-cardinality calendar columns, stored as ordered categoricals
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October',
+          'November', 'December']
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+TIME_PERIODS = ['00-1'] + [str(hour) + "-" + str(hour + 1) for hour in range(1, 23)] + ['23-00']
 
-    # If pattern1 doesn't match, try pattern2
-    if not dates:
-        messages = re.split(pattern2, data)[1:]
-        dates = re.findall(pattern2, data)
+# Every derived column preprocess adds by default, in output order
+DATE_FEATURES = ('only_date', 'year', 'month_num', 'month', 'day', 'hour', 'minute', 'day_name', 'time_period')
+
+
+def iter_lines(data):
+    # Accept a decoded string, raw bytes, a binary/text file object (e.g. Streamlit's UploadedFile)
+    # or any iterable of lines, and yield the export one line at a time without decoding it whole.
+    if isinstance(data, str):
+        yield from io.StringIO(data)
+        return
+    if isinstance(data, (bytes, bytearray)):
+        data = io.BytesIO(data)
+    if not hasattr(data, 'read'):
+        yield from data
+        return
+    if hasattr(data, 'seek'):
+        data.seek(0)
+    if isinstance(data, io.TextIOBase):
+        yield from data
+        return
+    text = io.TextIOWrapper(data, encoding='utf-8', newline='')
+    try:
+        yield from text
+    finally:
+        # detach so that closing the wrapper does not close the caller's file object
+        text.detach()
+
+
+def parse_messages(lines):
+    # Single pass over the export: a line matching the header starts a new message, any other line
+    # is a continuation of the current (multi-line) message. Lines before the first header are ignored.
+    dates, users, messages = [], [], []
+    header = date_format = None
+    body = None
+    for line in lines:
+        if header is None:
+            for candidate, candidate_format in HEADER_FORMATS:
+                if candidate.match(line):
+                    header, date_format = candidate, candidate_format
+                    break
+            else:
+                continue
+
+        match = header.match(line)
+        if match is None:
+            if body is not None:
+                body.append(line)
+            continue
+
+        if body is not None:
+            messages.append(''.join(body))
+        dates.append(match.group('date'))
+        user = match.group('user')
+        users.append(user if user is not None else 'group notification')
+        body = [line[match.end():]]
+
+    if body is not None:
+        messages.append(''.join(body))
+
+    return dates, users, messages, date_format
+
+
+def last_message_offset(raw):
+    # Byte offset of the header line of the last message in a raw (bytes) export, found by
+    # walking the lines backwards, or None if no line has a message header.
+    end = len(raw)
+    while end > 0:
+        start = raw.rfind(b'\n', 0, end - 1) + 1
+        line = raw[start:end].decode('utf-8', errors='replace')
+        if any(header.match(line) for header, _ in HEADER_FORMATS):
+            return start
+        end = start
+    return None
+
+
+@instrument()
+def preprocess(data, date_features=DATE_FEATURES):
+    dates, users, messages, date_format = parse_messages(iter_lines(data))
 
     if not dates:
         raise ValueError("No date pattern matched in the input data.")
 
-    # Create DataFrame
-    df = pd.DataFrame({'user_message': messages, 'message_date': dates})
-    df['message_date'] = df['message_date'].str.strip()
-
-    # Adjust date format based on the pattern
-    if '[' in dates[0]:
-        date_format = r'[%d/%m/%y, %I:%M:%S %p]'
-    else:
-        date_format = r'%d/%m/%Y, %H:%M -'
-
-    df['message_date'] = pd.to_datetime(df['message_date'], format=date_format)
-    df.rename(columns={'message_date': 'date'}, inplace=True)
-
-    # Extract user and message
-    users = []
-    messages = []
-    for message in df['user_message']:
-        entry = re.split('([\w\W]+?):\s', message)
-        if entry[1:]:  # user name
-            users.append(entry[1])
-            messages.append(entry[2])
-        else:
-            users.append('group notification')
-            messages.append(entry[0])
-
-    df['user'] = users
-    df['message'] = messages
-    df.drop(columns=['user_message'], inplace=True)
-
-    # Extract additional date-related information
-    df['only_date'] = df['date'].dt.date
-    df['year'] = df['date'].dt.year
-    df['month_num'] = df['date'].dt.month
-    df['month'] = df['date'].dt.month_name()
-    df['day'] = df['date'].dt.day
-    df['hour'] = df['date'].dt.hour
-    df['minute'] = df['date'].dt.minute
-    df['day_name'] = df['date'].dt.day_name()
-
-    # Define time period
-    period = []
-    for hour in df[['day_name', 'hour']]['hour']:
-        if hour == 23:
-            period.append(str(hour) + "-" + str('00'))
-        elif hour == 0:
-            period.append(str('00') + "-" + str(hour + 1))
-        else:
-            period.append(str(hour) + "-" + str(hour + 1))
-    df['time_period'] = period
+    # Create DataFrame straight from the columnar buffers
+    df = pd.DataFrame({
+        'date': pd.to_datetime(pd.Series(dates), format=date_format),
+        'user': users,
+        'message': messages,
+    })
+    del dates, users, messages
+
+    return add_date_features(df, date_features)
+
+
+def add_date_features(df, columns=DATE_FEATURES):
+    # Derive the calendar columns from 'date' in one vectorized pass. month, day_name and
+    # time_period are ordered categoricals built from integer codes, so no per-row strings are made.
+    unknown = set(columns) - set(DATE_FEATURES)
+    if unknown:
+        raise ValueError("Unknown date features: " + ", ".join(sorted(unknown)))
 
+    dates = df['date'].dt
+    month_num = dates.month
+    hour = dates.hour
+    features = {
+        'only_date': lambda: dates.normalize(),
+        'year': lambda: dates.year,
+        'month_num': lambda: month_num,
+        'month': lambda: pd.Categorical.from_codes(month_num - 1, MONTHS, ordered=True),
+        'day': lambda: dates.day,
+        'hour': lambda: hour,
+        'minute': lambda: dates.minute,
+        'day_name': lambda: pd.Categorical.from_codes(dates.dayofweek, DAY_NAMES, ordered=True),
+        'time_period': lambda: pd.Categorical.from_codes(hour, TIME_PERIODS, ordered=True),
+    }
+    for column in DATE_FEATURES:
+        if column in columns:
+            df[column] = features[column]()
     return df
@@ -0,0 +1,175 @@
+from bisect import bisect_left
+import re
+import numpy as np
+import pandas as pd
+
+# Words, and every other non-space character (punctuation, emoji) as a token of its own
+TOKEN_PATTERN = re.compile(r'\w+|[^\w\s]')
+NGRAM = 3
+
+# Sorts after every character, so vocabulary[bisect_left(prefix):bisect_left(prefix + _LAST)]
+# are the tokens starting with prefix
+_LAST = '\U0010ffff'
+
+MODES = ('literal', 'prefix', 'all')
+
+# Bump whenever SearchIndex changes, so the indexes pickled by chat_cache are built again
+SEARCH_INDEX_VERSION = 1
+
+
+def _union(arrays):
+    if not arrays:
+        return np.empty(0, dtype=np.int64)
+    if len(arrays) == 1:
+        return arrays[0]
+    return np.unique(np.concatenate(arrays))
+
+
+def _intersect(arrays):
+    # smallest first, so the running result only shrinks
+    arrays = sorted(arrays, key=len)
+    result = arrays[0]
+    for rows in arrays[1:]:
+        if not len(result):
+            break
+        result = np.intersect1d(result, rows, assume_unique=True)
+    return result
+
+
+class SearchIndex:
+    """
+    Case-insensitive search over the messages of a parsed chat. An inverted index maps each
+    lowercased token to the sorted row positions of the messages containing it, stored as
+    one array of rows with per-token offsets, and a trigram index over the token vocabulary finds
+    the tokens containing a substring. Queries only look at the messages of candidate rows.
+    """
+
+    def __init__(self, df):
+        messages = df['message'].reset_index(drop=True)
+        num_rows = len(messages)
+        tokens = messages.str.lower().str.findall(TOKEN_PATTERN).explode().dropna()
+        codes, vocabulary = pd.factorize(tokens.to_numpy(dtype=object), sort=True)
+
+        # one (token, row) pair per token occurring in a message, sorted by token then row
+        pairs = np.unique(codes.astype(np.int64) * max(num_rows, 1) + tokens.index.to_numpy())
+        self.rows = pairs % max(num_rows, 1)
+        self.offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pairs // max(num_rows, 1), minlength=len(vocabulary)), out=self.offsets[1:])
+        self.vocabulary = vocabulary.tolist()
+
+        ngrams = {}
+        for code, token in enumerate(self.vocabulary):
+            for gram in {token[i:i + NGRAM] for i in range(len(token) - NGRAM + 1)}:
+                ngrams.setdefault(gram, []).append(code)
+        self.ngrams = {gram: np.array(token_codes, dtype=np.int64) for gram, token_codes in ngrams.items()}
+
+        self.user_codes, users = pd.factorize(df['user'])
+        self.code_of = {user: code for code, user in enumerate(users)}
+        self.dates = df['date'].to_numpy()
+        self.messages = messages.to_numpy(dtype=object)
+
+    def __getstate__(self):
+        # the messages are attached again from the chat frame, see attach
+        state = dict(self.__dict__)
+        state['messages'] = None
+        return state
+
+    def attach(self, df):
+        """
+        Point a loaded index at the messages of the frame it was built from.
+        """
+        self.messages = df['message'].to_numpy(dtype=object)
+        return self
+
+    def _token_rows(self, codes):
+        return _union([self.rows[self.offsets[code]:self.offsets[code + 1]] for code in codes])
+
+    def _prefix_codes(self, prefix):
+        return range(bisect_left(self.vocabulary, prefix), bisect_left(self.vocabulary, prefix + _LAST))
+
+    def _exact_codes(self, token):
+        code = bisect_left(self.vocabulary, token)
+        if code < len(self.vocabulary) and self.vocabulary[code] == token:
+            return [code]
+        return []
+
+    def _containing_codes(self, text):
+        if len(text) < NGRAM:
+            return [code for code, token in enumerate(self.vocabulary) if text in token]
+        candidates = [self.ngrams.get(text[i:i + NGRAM]) for i in range(len(text) - NGRAM + 1)]
+        if any(codes is None for codes in candidates):
+            return []
+        return [code for code in _intersect(candidates) if text in self.vocabulary[code]]
+
+    def literal_rows(self, text, candidates=None):
+        """
+        Rows whose message contains text, ignoring case. Each token of text narrows the candidate
+        rows: inner tokens must be whole tokens, the first may end a token, the last may start
+        one and a lone token may lie anywhere in a token; candidates are then checked literally.
+        """
+        text = text.lower()
+        spans = [match.span() for match in TOKEN_PATTERN.finditer(text)]
+        token_rows = []
+        for start, end in spans:
+            word = text[start:end]
+            if start == 0 and end == len(text):
+                codes = self._containing_codes(word)
+            elif start == 0:
+                codes = [code for code in self._containing_codes(word) if self.vocabulary[code].endswith(word)]
+            elif end == len(text):
+                codes = self._prefix_codes(word)
+            else:
+                codes = self._exact_codes(word)
+            token_rows.append(self._token_rows(codes))
+        if candidates is not None:
+            token_rows.append(candidates)
+
+        rows = _intersect(token_rows) if token_rows else np.arange(len(self.messages))
+        if spans == [(0, len(text))]:
+            # a query that is one token is found exactly by the token lookup
+            return rows
+        return rows[np.fromiter((text in self.messages[row].lower() for row in rows), dtype=bool, count=len(rows))]
+
+    def prefix_rows(self, term, candidates=None):
+        """
+        Rows with a token starting with each word of term.
+        """
+        token_rows = [self._token_rows(self._prefix_codes(word)) for word in TOKEN_PATTERN.findall(term.lower())]
+        if candidates is not None:
+            token_rows.append(candidates)
+        return _intersect(token_rows) if token_rows else np.empty(0, dtype=np.int64)
+
+    def filter_rows(self, users=None, start=None, end=None):
+        """
+        Rows sent by one of users, from start (inclusive) to end (exclusive), or None if no
+        filter is given.
+        """
+        if users is None and start is None and end is None:
+            return None
+        mask = np.ones(len(self.user_codes), dtype=bool)
+        if users is not None:
+            codes = [self.code_of[user] for user in users if user in self.code_of]
+            mask &= np.isin(self.user_codes, codes)
+        if start is not None:
+            mask &= self.dates >= np.datetime64(pd.Timestamp(start))
+        if end is not None:
+            mask &= self.dates < np.datetime64(pd.Timestamp(end))
+        return np.flatnonzero(mask)
+
+    def search(self, query, mode='literal', users=None, start=None, end=None):
+        """
+        Sorted row positions of the messages matching query. mode 'literal' matches the query as
+        one case-insensitive substring (no regular expression), 'prefix' requires a word starting
+        with each whitespace-separated term and 'all' requires every term as a substring.
+        """
+        if mode not in MODES:
+            raise ValueError("Unknown search mode: " + mode)
+        candidates = self.filter_rows(users, start, end)
+        if mode == 'literal':
+            return self.literal_rows(query, candidates)
+        for term in query.split():
+            if mode == 'prefix' and TOKEN_PATTERN.search(term):
+                candidates = self.prefix_rows(term, candidates)
+            else:
+                candidates = self.literal_rows(term, candidates)
+        return candidates if candidates is not None else np.arange(len(self.messages))
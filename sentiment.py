@@ -0,0 +1,95 @@
+from concurrent.futures import ProcessPoolExecutor
+import re
+import numpy as np
+import pandas as pd
+from analysis import MEDIA_MESSAGE
+import lexicons
+import links
+
+# Compiled once; used by the batch pipeline below and by the per-message helpers in helper.py
+EMOJI_PATTERN = re.compile("["
+                           u"\U0001F600-\U0001F64F"  # emoticons
+                           u"\U0001F300-\U0001F5FF"  # symbols & pictographs
+                           u"\U0001F680-\U0001F6FF"  # transport & map symbols
+                           u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
+                           u"\U00002500-\U00002BEF"  # chinese char
+                           u"\U00002702-\U000027B0"
+                           u"\U00002702-\U000027B0"
+                           u"\U000024C2-\U0001F251"
+                           u"\U0001f926-\U0001f937"
+                           u"\U00010000-\U0010ffff"
+                           u"\u2640-\u2642"
+                           u"\u2600-\u2B55"
+                           u"\u200d"
+                           u"\u23cf"
+                           u"\u23e9"
+                           u"\u231a"
+                           u"\ufe0f"  # dingbats
+                           u"\u3030"
+                           "]+", flags=re.UNICODE)
+NUMBER_PATTERN = re.compile(r'\d+')
+
+# Every label assign_sentiment_label and label_messages can produce
+SENTIMENTS = ['negative', 'neutral', 'positive']
+
+# Messages per process pool task when labelling in parallel
+CHUNK_SIZE = 50000
+
+
+def clean_messages(messages):
+    """
+    Strip emojis, links and numbers from a Series of messages.
+    """
+    messages = messages.str.replace(EMOJI_PATTERN, '', regex=True)
+    messages = messages.str.replace(links.LINK_PATTERN, '', regex=True)
+    return messages.str.replace(NUMBER_PATTERN, '', regex=True)
+
+
+def text_messages(df):
+    """
+    The rows of a parsed chat that are labelled for training, i.e. without media placeholders.
+    """
+    return df[df['message'] != MEDIA_MESSAGE]
+
+
+def _label_chunk(messages, positive_words_file, negative_words_file, stop_words_file):
+    messages = messages.reset_index(drop=True)
+    positive_words = lexicons.load_words(positive_words_file)
+    negative_words = lexicons.load_words(negative_words_file)
+    stop_words = lexicons.load_words(stop_words_file)
+
+    # tokenize once: one row per (message, token) in message order, dropping the stop words
+    tokens = clean_messages(messages).str.split().explode().dropna()
+    tokens = tokens[~tokens.str.lower().isin(stop_words)]
+    words = tokens.to_numpy()
+    rows = tokens.index.to_numpy()
+
+    # rejoin each message from its contiguous run of tokens, and count lexicon hits per message
+    positions = np.arange(len(messages))
+    starts = np.searchsorted(rows, positions, side='left')
+    ends = np.searchsorted(rows, positions, side='right')
+    cleaned = [' '.join(words[start:end]) for start, end in zip(starts, ends)]
+    positive_count = np.bincount(rows, weights=tokens.isin(positive_words), minlength=len(messages))
+    negative_count = np.bincount(rows, weights=tokens.isin(negative_words), minlength=len(messages))
+
+    sentiment = np.select([positive_count > negative_count, negative_count > positive_count],
+                          ['positive', 'negative'], 'neutral')
+    return pd.DataFrame({'message': cleaned, 'sentiment': sentiment})
+
+
+def label_messages(messages, positive_words_file=lexicons.POSITIVE_WORDS_FILE,
+                   negative_words_file=lexicons.NEGATIVE_WORDS_FILE, stop_words_file=lexicons.STOP_WORDS_FILE,
+                   processes=1, chunk_size=CHUNK_SIZE):
+    """
+    Clean a Series of messages and label each one positive, negative or neutral by counting
+    lexicon hits among its non stop-word tokens. With processes > 1, large inputs are split into
+    chunks labelled in a process pool.
+    """
+    files = (positive_words_file, negative_words_file, stop_words_file)
+    if processes <= 1 or len(messages) <= chunk_size:
+        return _label_chunk(messages, *files)
+
+    chunks = [messages.iloc[start:start + chunk_size] for start in range(0, len(messages), chunk_size)]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        labelled = list(pool.map(_label_chunk, chunks, *[[file] * len(chunks) for file in files]))
+    return pd.concat(labelled, ignore_index=True)
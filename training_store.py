@@ -0,0 +1,187 @@
+import os
+import tempfile
+import threading
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Labelled messages are stored as append-only Parquet files, one directory per sentiment label
+# (sentiment=<label>/<sequence>-<batch>.parquet), so reads of one label only open its files
+TRAINING_DIR = os.environ.get('TRAINING_DATA_DIR', 'training_data')
+LEGACY_CSV = 'training_data.csv'
+COMPACT_ROWS = 50000
+CHUNK_SIZE = 20000
+
+SCHEMA = pa.schema([('message', pa.string()), ('hash', pa.uint64()), ('batch', pa.string())])
+
+# serializes appends and compaction with reads, which must not see a partly compacted label
+_lock = threading.RLock()
+
+
+def message_hashes(messages):
+    """
+    One 64-bit hash per message; rows are deduplicated on it.
+    """
+    return pd.util.hash_array(np.asarray(messages, dtype=object))
+
+
+def _dataset(directory):
+    return ds.dataset(directory, format='parquet', partitioning='hive', schema=SCHEMA.append(pa.field('sentiment', pa.string())))
+
+
+def _files(directory):
+    # every partition file, oldest first within each label
+    files = []
+    for entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+        if entry.is_dir() and entry.name.startswith('sentiment='):
+            files.extend(sorted(os.path.join(entry.path, name) for name in os.listdir(entry.path)
+                                if name.endswith('.parquet')))
+    return files
+
+
+def is_empty(directory=TRAINING_DIR):
+    """
+    Whether the store holds no file yet.
+    """
+    with _lock:
+        return not os.path.isdir(directory) or not _files(directory)
+
+
+def stored_hashes(directory=TRAINING_DIR):
+    """
+    The message hashes already in the store, read from the hash column only. Holds the lock,
+    so a compaction cannot remove a file the scan is about to read.
+    """
+    with _lock:
+        if is_empty(directory):
+            return np.empty(0, dtype=np.uint64)
+        return _dataset(directory).to_table(columns=['hash']).column('hash').to_numpy()
+
+
+def _write_table(path, table):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + '.', suffix='.tmp')
+    os.close(fd)
+    try:
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def append(training_data, batch=None, directory=TRAINING_DIR):
+    """
+    Add labelled messages (a frame with message and sentiment columns) as a new ingestion batch,
+    skipping messages already in the store or repeated within the batch. Returns the number of
+    rows written.
+    """
+    if batch is None:
+        batch = time.strftime('%Y%m%d%H%M%S')
+    training_data = training_data.dropna(subset=['message', 'sentiment'])
+    messages = training_data['message'].astype(str).to_numpy(dtype=object)
+    hashes = message_hashes(messages)
+
+    with _lock:
+        new = ~pd.Series(hashes).duplicated().to_numpy() & ~np.isin(hashes, stored_hashes(directory))
+        if not new.any():
+            return 0
+        rows = pd.DataFrame({'message': messages[new], 'hash': hashes[new], 'batch': batch,
+                             'sentiment': training_data['sentiment'].astype(str).to_numpy()[new]})
+        sequence = '%020d' % time.time_ns()
+        for label, part in rows.groupby('sentiment', sort=True):
+            partition = os.path.join(directory, 'sentiment=%s' % label)
+            os.makedirs(partition, exist_ok=True)
+            table = pa.Table.from_pandas(part.drop(columns='sentiment'), schema=SCHEMA, preserve_index=False)
+            _write_table(os.path.join(partition, '%s-%s.parquet' % (sequence, batch)), table)
+    return int(new.sum())
+
+
+def _filter(sentiments, batches):
+    expression = None
+    if sentiments is not None:
+        expression = ds.field('sentiment').isin(list(sentiments))
+    if batches is not None:
+        batch_filter = ds.field('batch').isin(list(batches))
+        expression = batch_filter if expression is None else expression & batch_filter
+    return expression
+
+
+def read(directory=TRAINING_DIR, sentiments=None, batches=None, columns=('message', 'sentiment')):
+    """
+    Load the stored rows, optionally only those with the given sentiment labels and/or from the
+    given ingestion batches. Label filters skip whole partitions; batch filters use the Parquet
+    column statistics.
+    """
+    columns = list(columns)
+    with _lock:
+        if not os.path.isdir(directory) or not _files(directory):
+            return pd.DataFrame({column: pd.Series(dtype=object) for column in columns})
+        table = _dataset(directory).to_table(columns=columns, filter=_filter(sentiments, batches))
+    return table.to_pandas()
+
+
+def iter_chunks(directory=TRAINING_DIR, sentiments=None, batches=None, chunk_size=CHUNK_SIZE):
+    """
+    Yield (messages, labels) chunks of the store without loading it whole. Compaction waits
+    until the iteration is finished.
+    """
+    with _lock:
+        if not os.path.isdir(directory) or not _files(directory):
+            return
+        scanner = _dataset(directory).scanner(columns=['message', 'sentiment'], filter=_filter(sentiments, batches),
+                                              batch_size=chunk_size)
+        for record_batch in scanner.to_batches():
+            if record_batch.num_rows:
+                chunk = record_batch.to_pandas()
+                yield chunk['message'], chunk['sentiment']
+
+
+def compact(directory=TRAINING_DIR, min_rows=COMPACT_ROWS):
+    """
+    Merge the files holding fewer than min_rows rows of each label into one file, keeping
+    the rows in ingestion order.
+    """
+    if not os.path.isdir(directory):
+        return
+    with _lock:
+        partitions = {}
+        for path in _files(directory):
+            partitions.setdefault(os.path.dirname(path), []).append(path)
+        for paths in partitions.values():
+            # runs of consecutive small files, so merging never reorders rows
+            runs = [[]]
+            for path in paths:
+                if pq.ParquetFile(path).metadata.num_rows < min_rows:
+                    runs[-1].append(path)
+                elif runs[-1]:
+                    runs.append([])
+            for run in runs:
+                if len(run) < 2:
+                    continue
+                table = pa.concat_tables([pq.read_table(path, schema=SCHEMA) for path in run])
+                # the merged file takes the place of the oldest one, then the others are dropped
+                _write_table(run[0], table)
+                for path in run[1:]:
+                    os.remove(path)
+
+
+def compact_in_background(directory=TRAINING_DIR, min_rows=COMPACT_ROWS):
+    """
+    Run compact in a daemon thread and return the thread.
+    """
+    thread = threading.Thread(target=compact, args=(directory, min_rows), daemon=True)
+    thread.start()
+    return thread
+
+
+def import_csv(path=LEGACY_CSV, directory=TRAINING_DIR, batch='legacy-csv'):
+    """
+    Copy the rows of a training CSV into the store, parsing it once. Returns the rows written.
+    """
+    written = 0
+    for chunk in pd.read_csv(path, chunksize=CHUNK_SIZE, encoding_errors='replace'):
+        written += append(chunk, batch, directory)
+    return written
@@ -0,0 +1,89 @@
+import functools
+import weakref
+import numpy as np
+import pandas as pd
+
+OVERALL = 'Overall'
+GROUP_NOTIFICATION = 'group notification'
+
+
+class UserIndex:
+    """
+    The users of a parsed chat interned to integer codes, with the rows of each user stored
+    contiguously: a stable sort permutation of the rows by user code plus per-user offsets.
+    Only the codes are computed up front; the permutation and the grouped copy of the frame are
+    built the first time a user's rows are asked for.
+    """
+
+    def __init__(self, df):
+        codes, users = pd.factorize(df['user'], sort=True)
+        self.codes = codes
+        self.users = users.tolist()
+        self.code_of = {user: code for code, user in enumerate(self.users)}
+        # a weak reference, so the cached index does not keep its frame alive
+        self._df = weakref.ref(df)
+
+    @functools.cached_property
+    def order(self):
+        return np.argsort(self.codes, kind='stable')
+
+    @functools.cached_property
+    def offsets(self):
+        offsets = np.zeros(len(self.users) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.codes, minlength=len(self.users)), out=offsets[1:])
+        return offsets
+
+    @functools.cached_property
+    def grouped(self):
+        # one copy of the frame grouped by user, in date order within each user;
+        # every per-user frame is a slice of it
+        return self._df().take(self.order)
+
+    def bounds(self, user):
+        code = self.code_of.get(user)
+        if code is None:
+            return 0, 0
+        return self.offsets[code], self.offsets[code + 1]
+
+    def rows(self, user):
+        """
+        Row positions of a user's messages in the original frame.
+        """
+        start, end = self.bounds(user)
+        return self.order[start:end]
+
+    def frame(self, user):
+        """
+        The messages of one user as a slice of the grouped frame, without filtering or copying.
+        """
+        start, end = self.bounds(user)
+        return self.grouped.iloc[start:end]
+
+    def user_list(self):
+        """
+        'Overall' followed by the sorted users, as shown in the sidebar.
+        """
+        return [OVERALL] + [user for user in self.users if user != GROUP_NOTIFICATION]
+
+
+_indexes = {}
+
+
+def user_index(df):
+    """
+    Return the UserIndex of a parsed chat, building it on first use. The index lives as long as
+    the frame, which must not be modified afterwards.
+    """
+    key = id(df)
+    index = _indexes.get(key)
+    if index is None:
+        index = UserIndex(df)
+        _indexes[key] = index
+        weakref.finalize(df, _indexes.pop, key, None)
+    return index
+
+
+def user_frame(df, selected_user):
+    if selected_user == OVERALL:
+        return df
+    return user_index(df).frame(selected_user)